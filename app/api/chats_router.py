@@ -2,7 +2,9 @@
 This module contains a router for http chat methods
 """
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, Query, Response
+from fastapi.responses import StreamingResponse
+from app.db.chat_versions import etag_matches
 from app.services.chats.chats_service import ChatsService
 
 
@@ -10,29 +12,99 @@ chats_router = APIRouter()
 
 
 @chats_router.get("/chats/getChats")
-def get_user_chats(chat_service: ChatsService = Depends()):
+async def get_user_chats(response: Response,
+                         before: str | None = None,
+                         after: str | None = None,
+                         limit: int | None = Query(default=None, ge=1, le=500),
+                         if_none_match: str | None = Header(default=None),
+                         chat_service: ChatsService = Depends()):
     """
-    Returns all the user chats
+    Returns the user chats, most recently active first, with their message
+    count and a preview of the last answer.
+    With limit, returns the page of chats listed after the `before` cursor
+    (or before the `after` cursor), the cursors are the `cursor` field of
+    the listed chats.
+    Answers 304 when If-None-Match has the current ETag of the list
     """
+    etag = chat_service.chats_etag()
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
 
-    chats = chat_service.get_user_chats()
-    return {"success": True, "message": chats}
+    chats, has_more = await chat_service.get_user_chats(
+        before=before, after=after, limit=limit)
+    response.headers["ETag"] = etag
+    return {"success": True, "message": chats, "has_more": has_more}
 
 
 @chats_router.get("/chats/getChatContent/{chat_id}")
-def get_chat_content(chat_id: int, chat_service: ChatsService = Depends()):
+async def get_chat_content(chat_id: int,
+                           response: Response,
+                           before: int | None = None,
+                           after: int | None = None,
+                           limit: int | None = Query(default=None, ge=1, le=500),
+                           prefetch: bool = False,
+                           if_none_match: str | None = Header(default=None),
+                           chat_service: ChatsService = Depends()):
     """
-    Gets the chat contents
+    Gets the chat contents.
+    With limit, returns the newest page of messages before the `before`
+    interaction id (or the oldest page after the `after` interaction id).
+    With ?prefetch=true opening the chat also warms the llm prompt cache
+    with its history, older pages (`before`) never prefetch.
+    Answers 304 when If-None-Match has the current ETag of the chat
     """
-    messages = chat_service.get_user_chat_content(chat_id=chat_id)
-    response = {"chat_id": chat_id, "messages": messages}
-    return {"success": True, "message": response}
+    if prefetch and before is None:
+        chat_service.prefetch_chat(chat_id)
+    etag = chat_service.chat_content_etag(chat_id)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    messages, has_more = await chat_service.get_user_chat_content(
+        chat_id=chat_id, before=before, after=after, limit=limit)
+    response.headers["ETag"] = etag
+    content = {"chat_id": chat_id, "messages": messages, "has_more": has_more}
+    return {"success": True, "message": content}
+
+
+@chats_router.get("/chats/getChatContent/{chat_id}/stream")
+async def stream_chat_content(chat_id: int, chat_service: ChatsService = Depends()):
+    """
+    Streams the chat contents as NDJSON, one message per line
+    """
+    return StreamingResponse(
+        chat_service.stream_user_chat_content(chat_id=chat_id),
+        media_type="application/x-ndjson")
+
+
+@chats_router.get("/chats/sync")
+async def sync_chats(since: int | None = None,
+                     limit: int = Query(default=500, ge=1, le=1000),
+                     chat_service: ChatsService = Depends()):
+    """
+    Returns the chats and interactions created or deleted after the `since`
+    cursor and the cursor for the next call. Clients keep calling while
+    has_more is true, and fetch everything again when reset is true
+    """
+    changes = await chat_service.sync_chats(since=since, limit=limit)
+    return {"success": True, "message": changes}
+
+
+@chats_router.get("/chats/search")
+async def search_chats(q: str,
+                       limit: int = Query(default=20, ge=1, le=100),
+                       chat_service: ChatsService = Depends()):
+    """
+    Searches the text of every chat, best matches first.
+    Matches are highlighted with <mark> tags on the snippets
+    """
+    results = await chat_service.search_chats(text=q, limit=limit)
+    return {"success": True, "message": results}
 
 
 @chats_router.delete("/chats/{chat_id}")
-def delete_chat(chat_id: int, chat_service: ChatsService = Depends()):
+async def delete_chat(chat_id: int, chat_service: ChatsService = Depends()):
     """
     Deletes a chat from the local database
     """
-    chat_service.delete_chat(chat_id=chat_id)
+    await chat_service.delete_chat(chat_id=chat_id)
     return {"success": True, "message": "Chat deleted successfully"}
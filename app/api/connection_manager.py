@@ -2,21 +2,21 @@
 This module contains a class with tools for websocket connection handling
 """
 
-from typing import List
-import math
-import numpy as np
+import uuid
 from fastapi import WebSocket
+from app.utils.socket_channel.socket_channel import SocketChannel, negotiate_protocol
 from app.utils.model_loading.model_loading import aurelius_models
 
 
 class ConnectionManager:
     """
     This class is used as an auxiliar for 
-    connect, and disconnect websockets
+    connect, and disconnect websockets.
+    Connections are kept by id, every one with its own send queue
     """
 
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: dict[str, SocketChannel] = {}
 
     def get_llm_model(self):
         """
@@ -30,42 +30,29 @@ class ConnectionManager:
         """
         return aurelius_models['stt']
 
-    async def connect(self, websocket: WebSocket):
-        """This method receives a websocket from the frontend"""
-        await websocket.accept()
-        self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        """This method disconnects a websocket from the frontend"""
-        self.active_connections.remove(websocket)
-
-    def is_silence(self, chunk: bytes, threshold_db: int = -40) -> bool:
+    def get_model_registry(self):
         """
-        Detect silence using Math/Numpy on Raw PCM data.
-        It only works with PCM Audio
+        Returns the registry of the models loaded on the background
         """
-        try:
-            if len(chunk) == 0:
-                return True
-            audio_data = np.frombuffer(chunk, dtype=np.int16)
-
-            if len(audio_data) == 0:
-                return True
-
-            # Calculate RMS (Root Mean Square) Amplitude
-            rms = np.sqrt(np.mean(audio_data.astype(np.int64)**2))
-
-            # 3. Convert RMS to Decibels (dB)
-            # 32768 is the max amplitude for 16-bit audio
-            if rms > 0:
-                db = 20 * math.log10(rms / 32768)
-            else:
-                db = -999  # Absolute silence
-
-            is_silent = db < threshold_db
+        return aurelius_models['registry']
 
-            return is_silent
-
-        except (ValueError, TypeError, ZeroDivisionError) as e:
-            print(f"Error detecting silence: {e}")
-            return False  # Default to False so we don't cut off user on errors
+    async def connect(self, websocket: WebSocket) -> SocketChannel:
+        """
+        This method receives a websocket from the frontend.
+        Returns the channel used to send its frames, on the protocol
+        the client negotiated (aurelius.msgpack or aurelius.json)
+        """
+        protocol = negotiate_protocol(websocket)
+        await websocket.accept(subprotocol=protocol)
+        channel = SocketChannel(websocket, connection_id=uuid.uuid4().hex,
+                                protocol=protocol)
+        self.active_connections[channel.connection_id] = channel
+        return channel
+
+    def disconnect(self, channel: SocketChannel):
+        """
+        This method disconnects a websocket from the frontend,
+        the frames it did not send yet are dropped
+        """
+        channel.close()
+        self.active_connections.pop(channel.connection_id, None)
@@ -2,7 +2,10 @@
 This router cotains health endpoints
 """
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+from app.utils.model_loading.model_loading import get_model_registry
+from app.utils.model_loading.model_registry import ModelRegistry
 
 
 health_router = APIRouter()
@@ -12,3 +15,17 @@ health_router = APIRouter()
 def check_health():
     """Health check endpoint"""
     return {"success": True, "status": "healthy", "message": "Service is running"}
+
+
+@health_router.get("/health/ready")
+def check_ready(model_registry: ModelRegistry = Depends(get_model_registry)):
+    """
+    Readiness of the models loaded on the background.
+    It answers 503 while a preloaded model is still loading, every model is
+    listed with its state (pending, loading, ready or failed) and load time
+    """
+    ready = model_registry.ready()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"success": ready, "ready": ready,
+                 "models": model_registry.snapshot()})
@@ -1,6 +1,8 @@
-"""This module contains everything needed for establish 
+"""This module contains everything needed for establish
 a communication between frontend and backend using websockets"""
 
+import asyncio
+import json
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from app.api.connection_manager import ConnectionManager
 
@@ -10,27 +12,89 @@ text_router = APIRouter()
 manager = ConnectionManager()
 
 
+def parse_control(text: str) -> str | None:
+    """
+    Returns the type of a control message like {"type": "cancel"},
+    or None when the text is a prompt
+    """
+    if not text.startswith("{"):
+        return None
+    try:
+        message = json.loads(text)
+    except ValueError:
+        return None
+    if isinstance(message, dict) and message.get("type") == "cancel":
+        return "cancel"
+    return None
+
+
 @text_router.websocket("/ws/text/{chat_id}")
-async def electron_prompt(websocket: WebSocket, chat_id: int):
+async def electron_prompt(websocket: WebSocket, chat_id: int, voice: bool = False):
     """
     This method receives and handles the websocket connection from the frontend.
+    Prompts are answered one after the other while the socket keeps reading,
+    so a {"type": "cancel"} message stops the answer being generated.
+    Frames are sent through the connection channel, which coalesces the
+    token frames and speaks msgpack to clients that negotiate it
     :param websocket: WebSocket connection
     :type websocket: WebSocket
+    :param voice: Also send the answers as audio, ?voice=true
+    :type voice: bool
     """
-    await manager.connect(websocket=websocket)
+    channel = await manager.connect(websocket=websocket)
     llm_service = manager.get_llm_model()
+    if voice:
+        # Kokoro loads while the first answer streams as text
+        manager.get_model_registry().request("tts")
+    prompts: asyncio.Queue = asyncio.Queue()
+    current: asyncio.Task | None = None
+
+    def remember_chat(new_chat_id: int):
+        nonlocal chat_id
+        chat_id = new_chat_id
+
+    async def answer_prompts():
+        nonlocal chat_id, current
+        while True:
+            prompt = await prompts.get()
+            # A new chat (chat_id 0) gets its id after the first interaction
+            current = asyncio.create_task(
+                llm_service.assemble_prompt(prompt,
+                                            websocket=channel,
+                                            chat_id=chat_id,
+                                            use_voice=voice,
+                                            on_chat_created=remember_chat))
+            # wait does not raise when only the answer was cancelled
+            await asyncio.wait({current})
+            if current.cancelled():
+                await channel.send_json({"message": chat_id, "type": "cancelled"})
+            else:
+                chat_id = current.result()
+            current = None
 
+    answers = asyncio.create_task(answer_prompts())
     try:
         while True:
-            prompt = await websocket.receive_text()
+            receive = asyncio.ensure_future(websocket.receive_text())
+            await asyncio.wait({receive, answers},
+                               return_when=asyncio.FIRST_COMPLETED)
+            if answers.done():
+                receive.cancel()
+                # Re-raises the error that stopped the answers
+                answers.result()
+            prompt = receive.result()
 
-            await llm_service.assemble_prompt(prompt,
-                                              websocket=websocket,
-                                              chat_id=chat_id,
-                                              use_voice=False)
+            if parse_control(prompt) == "cancel":
+                if current is not None:
+                    current.cancel()
+                continue
+            prompts.put_nowait(prompt)
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
         print("Client disconnected")
     except (ValueError, IOError, RuntimeError, ConnectionError) as e:
         print(f"Error in websocket: {e}")
-        manager.disconnect(websocket)
+    finally:
+        answers.cancel()
+        if current is not None:
+            current.cancel()
+        manager.disconnect(channel)
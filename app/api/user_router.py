@@ -5,14 +5,16 @@ from fastapi import APIRouter, Depends
 from fastapi.responses import JSONResponse
 from fastapi import status
 from app.services.user.user_service import UserService
-from app.schemas.schemas import UserSetup
+from app.services.memory.memory_service import MemoryService
+from app.schemas.schemas import UserSetup, UserMemory
+from app.utils.model_loading.model_loading import get_memory_service
 
 
 user_router = APIRouter()
 
 
 @user_router.post("/user")
-def register_user(user: UserSetup, user_service: UserService = Depends()):
+async def register_user(user: UserSetup, user_service: UserService = Depends()):
     """
     This endpoint creates the local user onto the database
 
@@ -21,12 +23,12 @@ def register_user(user: UserSetup, user_service: UserService = Depends()):
     :param user_service: Description
     :type user_service: UserService
     """
-    user_service.register_user(user)
+    await user_service.register_user(user)
     return {"success": True, "message": "User created successfully"}
 
 
 @user_router.put("/user")
-def update_user(user: UserSetup, user_service: UserService = Depends()):
+async def update_user(user: UserSetup, user_service: UserService = Depends()):
     """
     This endpoint updates the local user
 
@@ -35,31 +37,31 @@ def update_user(user: UserSetup, user_service: UserService = Depends()):
     :param user_service: Description
     :type user_service: UserService
     """
-    user_service.update_user_info(user)
+    await user_service.update_user_info(user)
     return {"success": True, "message": "User updated successfully"}
 
 
 @user_router.get("/user")
-def get_user(user_service: UserService = Depends()):
+async def get_user(user_service: UserService = Depends()):
     """
     This endpoint gest all the user data
 
     :param user_service: Description
     :type user_service: UserService
     """
-    data = user_service.get_user_data()
+    data = await user_service.get_user_data()
     return {"success": True, "data": data}
 
 
 @user_router.get("/user/verifyRegistered")
-def verify_registered_user(user_service: UserService = Depends()):
+async def verify_registered_user(user_service: UserService = Depends()):
     """
     This endpoint verifies if theres already a user on the local database
 
     :param user_service: Description
     :type user_service: UserService
     """
-    if user_service.is_user_regitered():
+    if await user_service.is_user_regitered():
         return JSONResponse(
             status_code=status.HTTP_200_OK,
             content={"success": True, "message": "User is already registered"}
@@ -72,15 +74,15 @@ def verify_registered_user(user_service: UserService = Depends()):
 
 
 @user_router.get("/user/getInstalledModels")
-def get_installed_models(user_service: UserService = Depends()):
+async def get_installed_models(user_service: UserService = Depends()):
     """
     This endpoint returns all available ollama local models
 
     :param user_service: Description
     :type user_service: UserService
     """
-    if user_service.is_ollama_installed():
-        available_models = user_service.retrieve_ollama_models_list()
+    if await user_service.is_ollama_installed():
+        available_models = await user_service.retrieve_ollama_models_list()
         return {"success": True, "message": available_models}
     return JSONResponse(
         status_code=status.HTTP_412_PRECONDITION_FAILED,
@@ -90,16 +92,16 @@ def get_installed_models(user_service: UserService = Depends()):
 
 
 @user_router.get("/user/getConfig")
-def get_user_configuration(user_service: UserService = Depends()):
+async def get_user_configuration(user_service: UserService = Depends()):
     """
     This method gets the user info and the available models
 
     :param user_service: Description
     :type user_service: UserService
     """
-    if user_service.is_ollama_installed() and user_service.is_user_regitered():
-        available_models = user_service.retrieve_ollama_models_list()
-        user_info = user_service.get_user_data()
+    if await user_service.is_ollama_installed() and await user_service.is_user_regitered():
+        available_models = await user_service.retrieve_ollama_models_list()
+        user_info = await user_service.get_user_data()
         grouped_data = {"user_data": user_info,
                         "available_models": available_models}
         return {"success": True, "message": grouped_data, }
@@ -108,3 +110,19 @@ def get_user_configuration(user_service: UserService = Depends()):
         content={"succes": False,
                  "message": "You don't have ollama installed on your machine"}
     )
+
+
+@user_router.post("/user/memory")
+async def save_user_memory(memory: UserMemory,
+                           memory_service: MemoryService = Depends(get_memory_service)):
+    """
+    This endpoint saves something the assistant should remember about the user.
+    Only the memories related to each prompt are added to it
+
+    :param memory: Description
+    :type memory: UserMemory
+    :param memory_service: Description
+    :type memory_service: MemoryService
+    """
+    await memory_service.add_memory(memory.memory)
+    return {"success": True, "message": "Memory saved successfully"}
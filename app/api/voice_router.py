@@ -0,0 +1,157 @@
+"""This module contains the websocket used for hands-free voice prompts.
+The frontend streams raw microphone audio and receives the transcripts
+followed by the usual answer frames"""
+
+import asyncio
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from app.api.text_router import manager, parse_control
+from app.exceptions.exception_handling import (
+    ModelNotReadyException, TranscriptionException, socket_exeption_handling)
+from app.services.stt.utterance_segmenter import UtteranceSegmenter
+from app.utils.vad.vad import VoiceActivityDetector
+from app.utils.wav_converter.wav_converter import PCMResampler
+
+
+voice_router = APIRouter()
+
+
+@voice_router.websocket("/ws/voice/{chat_id}")
+async def electron_voice_prompt(websocket: WebSocket, chat_id: int, voice: bool = True,
+                                sample_rate: int = 16000, channels: int = 1):
+    """
+    This method receives the microphone audio from the frontend as binary frames
+    of 16 bit PCM, converted to 16 kHz mono as it arrives. Utterances are cut
+    on silence, partial transcripts are sent while the user speaks when an
+    STT worker can be spared for them (AURELIUS_STT_WORKERS over 1) and the
+    final one is answered as a prompt.
+    A text frame "end" finishes the current utterance right away and
+    {"type": "cancel"} stops the answer being generated.
+    Audio received while an answer is being generated is ignored so the
+    assistant never transcribes its own voice.
+    :param websocket: WebSocket connection
+    :type websocket: WebSocket
+    :param voice: Also send the answers as audio, ?voice=false to disable it
+    :type voice: bool
+    :param sample_rate: Sample rate of the microphone audio, like ?sample_rate=48000
+    :type sample_rate: int
+    :param channels: Channels of the microphone audio, they are downmixed to mono
+    :type channels: int
+    """
+    channel = await manager.connect(websocket=websocket)
+    llm_service = manager.get_llm_model()
+    stt_service = manager.get_stt_model()
+    model_registry = manager.get_model_registry()
+    if voice:
+        model_registry.request("tts")
+    try:
+        await model_registry.ensure("stt")
+    except ModelNotReadyException as e:
+        await socket_exeption_handling(
+            ws=channel, error_type="error",
+            message="An error occured on STT Service",
+            details=str(e.detail))
+        try:
+            await channel.drain()
+        except ConnectionError:
+            pass
+        manager.disconnect(channel)
+        await websocket.close()
+        return
+    segmenter = UtteranceSegmenter(
+        vad=VoiceActivityDetector(sample_rate=stt_service.sample_rate),
+        sample_rate=stt_service.sample_rate)
+    resampler = PCMResampler(sample_rate=sample_rate, channels=channels)
+    partial_task: asyncio.Task | None = None
+    answer_task: asyncio.Task | None = None
+
+    async def send_partial(pcm: bytes):
+        try:
+            text = await stt_service.transcribe_partial(pcm)
+        except TranscriptionException:
+            return
+        if text:
+            await channel.send_json({"message": text, "type": "partial_transcript"})
+
+    def remember_chat(new_chat_id: int):
+        nonlocal chat_id
+        chat_id = new_chat_id
+
+    async def answer(pcm: bytes):
+        nonlocal chat_id
+        try:
+            text = await stt_service.transcribe(pcm)
+        except TranscriptionException as e:
+            await socket_exeption_handling(
+                ws=channel, error_type="error",
+                message="An error occured on STT Service",
+                details=str(e.detail))
+            return
+        if not text:
+            return
+        await channel.send_json({"message": text, "type": "transcript"})
+        chat_id = await llm_service.assemble_prompt(text,
+                                                    websocket=channel,
+                                                    chat_id=chat_id,
+                                                    use_voice=voice,
+                                                    on_chat_created=remember_chat)
+
+    stop = asyncio.Event()
+
+    def task_finished(task: asyncio.Task):
+        # Nobody awaits the answer and partial tasks, a failure like the
+        # channel closing is logged here and ends the socket
+        if task.cancelled() or task.exception() is None:
+            return
+        print(f"Error in voice websocket: {task.exception()}")
+        stop.set()
+
+    stopped = asyncio.ensure_future(stop.wait())
+    try:
+        while True:
+            receive = asyncio.ensure_future(websocket.receive())
+            await asyncio.wait({receive, stopped},
+                               return_when=asyncio.FIRST_COMPLETED)
+            if stopped.done():
+                receive.cancel()
+                break
+            message = receive.result()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
+            if parse_control(message.get("text") or "") == "cancel":
+                if answer_task is not None and not answer_task.done():
+                    answer_task.cancel()
+                    await channel.send_json({"message": chat_id, "type": "cancelled"})
+                continue
+
+            if answer_task is not None and not answer_task.done():
+                continue
+
+            if message.get("bytes") is not None:
+                utterances = segmenter.push(resampler.process(message["bytes"]))
+            elif message.get("text") == "end":
+                utterance = segmenter.flush()
+                utterances = [utterance] if utterance is not None else []
+            else:
+                continue
+
+            if utterances:
+                if partial_task is not None:
+                    partial_task.cancel()
+                    partial_task = None
+                # Utterances completed by the same chunk are answered as one prompt
+                answer_task = asyncio.create_task(answer(b"".join(utterances)))
+                answer_task.add_done_callback(task_finished)
+            elif segmenter.partial_ready() and (partial_task is None or partial_task.done()):
+                partial_task = asyncio.create_task(send_partial(segmenter.current()))
+                partial_task.add_done_callback(task_finished)
+    except WebSocketDisconnect:
+        print("Voice client disconnected")
+    except (ValueError, IOError, RuntimeError, ConnectionError) as e:
+        print(f"Error in voice websocket: {e}")
+    finally:
+        stopped.cancel()
+        for task in (partial_task, answer_task):
+            if task is not None:
+                task.cancel()
+        manager.disconnect(channel)
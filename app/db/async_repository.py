@@ -0,0 +1,185 @@
+"""
+This module contains the async database access used by the event loop.
+Every query runs on dedicated database threads so a slow disk or a WAL
+checkpoint never stalls the websockets or the http endpoints
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from app.db.chat_versions import ChatVersions
+from app.db.init_db import AureliusDB
+from app.db.interaction_log import InteractionLog
+
+
+class AsyncAureliusDB:
+    """
+    Async facade over AureliusDB.
+    Writes are queued on a single writer thread, which matches the single
+    writer connection of the pool, and reads go to a small pool of reader
+    threads that keep their own read only connections.
+    New interactions go through a write-behind log, the queries that read
+    interactions flush it first so they never miss an answered one.
+    Every write that changes a chat bumps its version on versions
+    """
+
+    def __init__(self, database: AureliusDB, read_workers: int = 4):
+        self.database = database
+        self._writer = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="aurelius-db-writer")
+        self._readers = ThreadPoolExecutor(
+            max_workers=read_workers, thread_name_prefix="aurelius-db-reader")
+        self.interactions = InteractionLog(
+            partial(self._write, self.database.store_interactions))
+        self.versions = ChatVersions()
+
+    async def start(self):
+        """
+        Starts the write-behind interaction log and trims the change feed
+        """
+        last_interaction_id = await self._write(
+            self.database.get_last_interaction_id)
+        self.interactions.start(last_interaction_id)
+        await self._write(self.database.prune_change_feed,
+                          int(os.getenv('AURELIUS_CHANGE_FEED_ROWS', '10000')))
+
+    async def _read(self, method, *args, **kwargs):
+        """Runs a read query on the reader threads"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._readers, partial(method, *args, **kwargs))
+
+    async def _write(self, method, *args, **kwargs):
+        """Queues a write on the writer thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._writer, partial(method, *args, **kwargs))
+
+    async def register_user(self, name, model):
+        """Creates de aurelius user on the local database"""
+        return await self._write(self.database.register_user, name, model)
+
+    async def is_user_registerd(self):
+        """Returns the user name to verify if is already registered"""
+        return await self._read(self.database.is_user_registerd)
+
+    async def get_user_data(self):
+        """Retrieves all the user stored data"""
+        return await self._read(self.database.get_user_data)
+
+    async def update_user_data(self, name, model):
+        """Updates de user name and ollama model to be used"""
+        return await self._write(self.database.update_user_data, name, model)
+
+    async def save_memory(self, var, embedding=None, embedding_model=None):
+        """Saves an important value for understand better the user context"""
+        return await self._write(self.database.save_memory, var,
+                                 embedding=embedding, embedding_model=embedding_model)
+
+    async def load_memory(self):
+        """Loads all the memories saved from the user"""
+        return await self._read(self.database.load_memory)
+
+    async def load_memory_vectors(self):
+        """Loads every memory with its stored embedding"""
+        return await self._read(self.database.load_memory_vectors)
+
+    async def update_memory_embeddings(self, embeddings):
+        """Saves the embeddings of memories embedded again"""
+        return await self._write(self.database.update_memory_embeddings, embeddings)
+
+    async def get_user_model(self):
+        """Returns de user ollama model to be used"""
+        return await self._read(self.database.get_user_model)
+
+    async def get_user_chats(self, before=None, after=None, limit=None):
+        """
+        Gets the chat history from the user, the summaries come from the
+        triggers so the pending interactions are committed first
+        """
+        await self.interactions.flush()
+        return await self._read(self.database.get_user_chats,
+                                before=before, after=after, limit=limit)
+
+    async def get_chat_content(self, chat_id, before=None, after=None, limit=None):
+        """Gets the chat content including messages"""
+        await self.interactions.flush()
+        return await self._read(self.database.get_chat_content, chat_id,
+                                before=before, after=after, limit=limit)
+
+    async def iter_chat_content(self, chat_id, batch_size=200):
+        """Yields the chat content in batches, each one read on a reader thread"""
+        await self.interactions.flush()
+        batches = self.database.iter_chat_content(chat_id, batch_size=batch_size)
+        while True:
+            batch = await self._read(next, batches, None)
+            if batch is None:
+                return
+            yield batch
+
+    async def get_chat_turns(self, chat_id, count_tokens):
+        """
+        Gets the chat interactions with their token counts.
+        It runs on the writer thread because missing counts are saved back
+        """
+        await self.interactions.flush()
+        return await self._write(self.database.get_chat_turns, chat_id,
+                                 count_tokens=count_tokens)
+
+    async def search_interactions(self, fts_query, limit=20):
+        """Searches the interactions with the full text index"""
+        await self.interactions.flush()
+        return await self._read(self.database.search_interactions, fts_query,
+                                limit=limit)
+
+    async def get_changes(self, since, limit=500):
+        """Gets the chats and interactions changed after a feed cursor"""
+        await self.interactions.flush()
+        return await self._read(self.database.get_changes, since, limit=limit)
+
+    async def get_change_cursor(self):
+        """Gets the newest change feed cursor"""
+        await self.interactions.flush()
+        return await self._read(self.database.get_change_cursor)
+
+    async def create_chat(self, title):
+        """Creates a new chat"""
+        chat_id = await self._write(self.database.create_chat, title)
+        self.versions.bump_list()
+        return chat_id
+
+    async def store_interaction(self, chat_id, user_prompt, llm_answer,
+                                token_count=None):
+        """
+        Stores a new interaction between the user and the llm.
+        It returns right away, the row is committed with the next batch
+        """
+        interaction = self.interactions.append(chat_id, user_prompt, llm_answer,
+                                               token_count=token_count)
+        # Readers flush the log first, the new version is already readable.
+        # The chat list changes too, its activity order and summary moved
+        self.versions.bump_chat(chat_id)
+        self.versions.bump_list()
+        return interaction
+
+    async def delete_chat(self, chat_id):
+        """
+        Deletes a chat and its content.
+        Answers stored while the delete ran are dropped, the batch insert
+        skips the ones already taken by a flush
+        """
+        await self.interactions.flush()
+        result = await self._write(self.database.delete_chat, chat_id)
+        self.interactions.discard_chat(chat_id)
+        self.versions.bump_chat(chat_id)
+        self.versions.bump_list()
+        return result
+
+    async def close(self):
+        """
+        Commits the pending interactions, waits for the queued queries
+        and stops the database threads
+        """
+        await self.interactions.stop()
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
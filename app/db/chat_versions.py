@@ -0,0 +1,54 @@
+"""
+This module contains the version counters of the chats.
+Every change bumps a counter in memory, so a client polling an unchanged
+chat is answered with a comparison instead of a query
+"""
+import os
+import time
+
+
+class ChatVersions:
+    """
+    Monotonic versions of the chat list and of every chat content.
+    The counters live in memory and start again on every run, the ETags
+    include a process epoch so a restart never repeats an old ETag
+    """
+
+    def __init__(self):
+        self.epoch = f"{time.time_ns():x}{os.getpid():x}"
+        self.list_version = 0
+        self._chat_versions: dict[int, int] = {}
+
+    def bump_list(self):
+        """The chat list changed: a chat was created, deleted or got a message"""
+        self.list_version += 1
+
+    def bump_chat(self, chat_id: int):
+        """The content of a chat changed"""
+        self._chat_versions[chat_id] = self._chat_versions.get(chat_id, 0) + 1
+
+    def chat_version(self, chat_id: int) -> int:
+        """Returns the version of a chat content"""
+        return self._chat_versions.get(chat_id, 0)
+
+    def list_etag(self) -> str:
+        """ETag of the chat list"""
+        return f'W/"{self.epoch}-l{self.list_version}"'
+
+    def chat_etag(self, chat_id: int) -> str:
+        """ETag of a chat content"""
+        return f'W/"{self.epoch}-c{chat_id}-{self.chat_version(chat_id)}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Tells if an If-None-Match header matches the ETag, it may list several
+    ETags or be "*". Weak and strong forms compare equal
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque
+               for candidate in if_none_match.split(","))
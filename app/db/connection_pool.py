@@ -0,0 +1,95 @@
+"""
+This module contains the SQLite connection pool shared by the whole app.
+There is a single writer connection guarded by a lock and one read only
+connection per thread, all of them opened once and reused
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    """
+    Application scoped pool of SQLite connections.
+    WAL mode lets the readers work while the writer commits
+    """
+
+    def __init__(self, db_path: str):
+        db_dir = os.path.dirname(db_path)
+        if not os.access(db_dir, os.W_OK):
+            raise PermissionError(
+                f"No write permission in database directory: {db_dir}"
+            )
+
+        self.db_path = db_path
+        self._local = threading.local()
+        self._readers: list[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._closed = False
+
+        try:
+            self._writer = self._connect()
+            # Habilitar Write-Ahead Logging para mejor concurrencia
+            self._writer.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError as e:
+            raise sqlite3.OperationalError(
+                f"Failed to open database at {db_path}. Error: {e}"
+            )
+
+        print(f"[DB] Connected successfully to: {db_path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Opens a connection with the pragmas every connection needs"""
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            timeout=10.0
+        )
+        # Habilitar foreign keys
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """
+        Gives exclusive access to the writer connection.
+        The transaction is committed on exit and rolled back on errors
+        """
+        with self._write_lock:
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+
+    def reader(self) -> sqlite3.Connection:
+        """
+        Returns the read only connection of the current thread,
+        opening it the first time the thread asks for it
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Connection pool is closed")
+            conn = self._connect()
+            conn.execute("PRAGMA query_only=ON")
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    def close(self):
+        """
+        Closes the writer and every reader connection
+        """
+        self._closed = True
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        with self._write_lock:
+            self._writer.close()
+        print("[DB] Connection pool closed")
@@ -1,10 +1,12 @@
 """
 This module contains local database initialization for Aurelius app
 """
-import sqlite3
 import os
 import sys
+from datetime import datetime, timezone
 from pathlib import Path
+from app.db.connection_pool import ConnectionPool
+from app.db.migrations import apply_migrations
 
 
 def get_app_data_dir():
@@ -31,6 +33,13 @@ def get_app_data_dir():
     return app_dir
 
 
+def current_timestamp():
+    """
+    Returns the current UTC time in the same format as CURRENT_TIMESTAMP
+    """
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
 def get_database_path():
     """
     Obtiene la ruta completa a la base de datos
@@ -56,186 +65,218 @@ class AureliusDB:
     """
     This class contains database initialization methods 
     """
+    # Columns read by _chat_dict
+    _CHAT_COLUMNS = ("id, user_id, title, date_created, "
+                     "last_activity, message_count, preview")
 
-    def __init__(self, db_path=None):
+    def __init__(self, db_path=None, pool: ConnectionPool | None = None):
         """
-        Inicializa la conexión a la base de datos.
+        Inicializa el acceso a la base de datos.
 
         Args:
             db_path: Ruta personalizada a la BD. Si es None, usa la ubicación automática.
+            pool: Pool compartido de la aplicación. Si es None, se crea uno propio
+                y se verifican las tablas.
         """
-        if db_path is None:
-            db_path = get_database_path()
-
-        db_dir = os.path.dirname(db_path)
-        if not os.access(db_dir, os.W_OK):
-            raise PermissionError(
-                f"No write permission in database directory: {db_dir}"
-            )
-
-        try:
-            self.conn = sqlite3.connect(
-                db_path,
-                check_same_thread=False,
-                timeout=10.0
-            )
-            # Habilitar Write-Ahead Logging para mejor concurrencia
-            self.conn.execute("PRAGMA journal_mode=WAL")
-            # Habilitar foreign keys
-            self.conn.execute("PRAGMA foreign_keys=ON")
-
-            self.cursor = self.conn.cursor()
-            self.user_id = 1
-
-            print(f"[DB] Connected successfully to: {db_path}")
-            self._create_tables()
-
-        except sqlite3.OperationalError as e:
-            raise sqlite3.OperationalError(
-                f"Failed to open database at {db_path}. Error: {e}"
-            )
-
-    def _create_tables(self):
-        """Crea las tablas si no existen"""
-        self.cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_info (
-          id INTEGER PRIMARY KEY AUTOINCREMENT,
-          name TEXT UNIQUE NOT NULL,
-          current_model TEXT NOT NULL       
-        )
-        """)
-
-        self.cursor.execute("""
-        CREATE TABLE IF NOT EXISTS chats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            title TEXT,
-            date_created DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES user_info(id)
-        )
-        """)
-
-        self.cursor.execute("""
-        CREATE TABLE IF NOT EXISTS chat_interactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id INTEGER,
-            user_message TEXT,
-            model_message TEXT,
-            message_date DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (chat_id) REFERENCES chats(id)
-        )
-        """)
+        self.user_id = 1
+        self._owns_pool = pool is None
+
+        if pool is None:
+            if db_path is None:
+                db_path = get_database_path()
+            pool = ConnectionPool(db_path)
+            self.pool = pool
+            self.create_tables()
+        else:
+            self.pool = pool
 
-        self.cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_memory_context (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            var TEXT,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-        self.conn.commit()
-        print("[DB] Tables created/verified successfully")
+    def create_tables(self):
+        """Crea las tablas si no existen y aplica las migraciones pendientes"""
+        with self.pool.writer() as conn:
+            version = apply_migrations(conn)
+        print(f"[DB] Tables created/verified successfully (schema v{version})")
 
     def register_user(self, name, model):
         """
         This method creates de aurelius user on the local database
         """
-        self.cursor.execute("""
-        INSERT INTO user_info (id, name, current_model)
-        VALUES (?, ?, ?)
-        """, (self.user_id, name, model))
-        self.conn.commit()
+        with self.pool.writer() as conn:
+            conn.execute("""
+            INSERT INTO user_info (id, name, current_model)
+            VALUES (?, ?, ?)
+            """, (self.user_id, name, model))
 
     def is_user_registerd(self):
         """
         This method returns the user name 
         to verify if is already registered
         """
-        self.cursor.execute("""
+        cursor = self.pool.reader().execute("""
         SELECT name FROM user_info WHERE id = ?
         """, (self.user_id,))
-        return self.cursor.fetchone()
+        return cursor.fetchone()
 
     def get_user_data(self):
         """
         This method retrieves all the user stored data
         """
-        self.cursor.execute("""
+        cursor = self.pool.reader().execute("""
         SELECT name, current_model FROM user_info WHERE id = ?
         """, (self.user_id,))
-        return self.cursor.fetchone()
+        return cursor.fetchone()
 
     def update_user_data(self, name, model):
         """
         This method updates de user name and ollama model to be used
         """
-        self.cursor.execute("""
-        UPDATE user_info
-            SET name = ?,
-            current_model = ? 
-        WHERE id = ?
-        """, (name, model, self.user_id))
-        self.conn.commit()
-
-    def save_memory(self, var):
+        with self.pool.writer() as conn:
+            conn.execute("""
+            UPDATE user_info
+                SET name = ?,
+                current_model = ? 
+            WHERE id = ?
+            """, (name, model, self.user_id))
+
+    def save_memory(self, var, embedding=None, embedding_model=None):
         """
         This method saves an important value for understand better the user
-        context
+        context, optionally with its float32 embedding as a BLOB
         """
-        self.cursor.execute("""
-        INSERT INTO user_memory_context (var)
-        VALUES (?)
-        """, (var,))
-        self.conn.commit()
+        with self.pool.writer() as conn:
+            cursor = conn.execute("""
+            INSERT INTO user_memory_context (var, embedding, embedding_model)
+            VALUES (?, ?, ?)
+            """, (var, embedding, embedding_model))
+            new_id = cursor.lastrowid
+        return new_id
 
     def load_memory(self):
         """
         This method loads all the memories saved from the user to improve context
         """
-        self.cursor.execute("SELECT * FROM user_memory_context")
-        rows = self.cursor.fetchall()
-        return [row[1] for row in rows]
+        cursor = self.pool.reader().execute("SELECT var FROM user_memory_context")
+        rows = cursor.fetchall()
+        return [row[0] for row in rows]
+
+    def load_memory_vectors(self):
+        """
+        Loads every memory as (id, var, embedding, embedding_model) tuples
+        """
+        cursor = self.pool.reader().execute("""
+            SELECT id, var, embedding, embedding_model FROM user_memory_context
+            ORDER BY id ASC
+        """)
+        return cursor.fetchall()
+
+    def update_memory_embeddings(self, embeddings):
+        """
+        Saves the embeddings of memories stored without one,
+        or with one from a different embedding model.
+        embeddings is a list of (embedding, embedding_model, id) tuples
+        """
+        with self.pool.writer() as conn:
+            conn.executemany("""
+                UPDATE user_memory_context
+                SET embedding = ?, embedding_model = ?
+                WHERE id = ?
+            """, embeddings)
 
     def get_user_model(self):
         """
         This method returns de user ollama model to be used
         """
-        self.cursor.execute("""
+        cursor = self.pool.reader().execute("""
             SELECT current_model from user_info
         """)
-        row = self.cursor.fetchone()
+        row = cursor.fetchone()
         return row[0] if row else ""
 
-    def get_user_chats(self):
+    def get_user_chats(self, before=None, after=None, limit=None):
         """
-        Gets all the chat history from the user
+        Gets the chat history from the user, most recently active first.
+        Chats are sorted by their last activity (the id breaks ties) on the
+        (user_id, last_activity, id) index, the summary columns come from the
+        chat row so nothing is aggregated.
+        Keyset pagination: before/after are (last_activity, chat id) pairs
+        taken from a listed chat, so a cursor stays put when that chat gets
+        new messages or is deleted. limit keeps the chats listed right after
+        the before cursor (or the ones right before the after cursor)
         """
-        self.cursor.execute("""
-            SELECT * FROM chats WHERE user_id = ?
-        """, (self.user_id,))
+        conditions = ["user_id = ?"]
+        params = [self.user_id]
+        if before is not None:
+            conditions.append("(last_activity, id) < (?, ?)")
+            params.extend(before)
+        if after is not None:
+            conditions.append("(last_activity, id) > (?, ?)")
+            params.extend(after)
+
+        # The chats closest to an after cursor are the oldest of the newer ones
+        oldest_first = limit is not None and after is not None
+        order = "ASC" if oldest_first else "DESC"
+        query = f"""
+            SELECT {self._CHAT_COLUMNS} FROM chats
+            WHERE {" AND ".join(conditions)}
+            ORDER BY last_activity {order}, id {order}
+        """
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
 
-        rows = self.cursor.fetchall()
-        chats_dict = []
-        if len(rows) > 0:
-            for row in rows:
-                chats_dict.append({
-                    "chat_id": row[0],
-                    "user_id": row[1],
-                    "title": row[2],
-                    "date_created": row[3]
-                })
-        return chats_dict
+        rows = self.pool.reader().execute(query, params).fetchall()
+        if oldest_first:
+            rows.reverse()
+
+        return [self._chat_dict(row) for row in rows]
+
+    @staticmethod
+    def _chat_dict(row):
+        return {
+            "chat_id": row[0],
+            "user_id": row[1],
+            "title": row[2],
+            "date_created": row[3],
+            "last_activity": row[4],
+            "message_count": row[5],
+            "preview": row[6]
+        }
 
-    def get_chat_content(self, chat_id):
+    def get_chat_content(self, chat_id, before=None, after=None, limit=None,
+                         from_oldest=False):
         """
-        Gets all the chat content including messages
+        Gets the chat content including messages, oldest first.
+        Keyset pagination: before/after are interaction ids, limit keeps the
+        newest messages before the cursor (or the oldest ones after it, or
+        from the start of the chat with from_oldest).
+        The (message_date, id) row value comparison is an index range scan
         """
-        self.cursor.execute("""
-            SELECT * FROM chat_interactions WHERE chat_id = ?
-            ORDER BY message_date ASC
-        """, (chat_id, ))
+        conditions = ["chat_id = ?"]
+        params = [chat_id]
+        if before is not None:
+            conditions.append("""(message_date, id) <
+                (SELECT message_date, id FROM chat_interactions WHERE id = ?)""")
+            params.append(before)
+        if after is not None:
+            conditions.append("""(message_date, id) >
+                (SELECT message_date, id FROM chat_interactions WHERE id = ?)""")
+            params.append(after)
+
+        newest_first = limit is not None and after is None and not from_oldest
+        direction = "DESC" if newest_first else "ASC"
+        query = f"""
+            SELECT id, chat_id, user_message, model_message, message_date
+            FROM chat_interactions
+            WHERE {" AND ".join(conditions)}
+            ORDER BY message_date {direction}, id {direction}
+        """
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        rows = self.pool.reader().execute(query, params).fetchall()
+        if newest_first:
+            rows.reverse()
 
-        rows = self.cursor.fetchall()
         messages = []
 
         if len(rows) > 0:
@@ -249,82 +290,276 @@ class AureliusDB:
                 })
         return messages
 
+    def iter_chat_content(self, chat_id, batch_size=200):
+        """
+        Yields the chat content in batches, oldest first.
+        Every batch is a separate keyset query so no cursor or read
+        transaction stays open between batches
+        """
+        after = None
+        while True:
+            batch = self.get_chat_content(chat_id, after=after, limit=batch_size,
+                                          from_oldest=True)
+            if not batch:
+                return
+            yield batch
+            if len(batch) < batch_size:
+                return
+            after = batch[-1]["interaction_id"]
+
     def get_chat_content_ollama(self, chat_id):
         """
         Gets all the chat content including messages in ollama format
         """
-        self.cursor.execute("""
-            SELECT * FROM chat_interactions WHERE chat_id = ?
-            ORDER BY message_date ASC
+        cursor = self.pool.reader().execute("""
+            SELECT user_message, model_message
+            FROM chat_interactions WHERE chat_id = ?
+            ORDER BY message_date ASC, id ASC
         """, (chat_id, ))
 
-        rows = self.cursor.fetchall()
+        rows = cursor.fetchall()
         messages = []
 
         if len(rows) > 0:
             for row in rows:
-                messages.append({"role": "user", "content": row[2]})
-                messages.append({"role": "assistant", "content": row[3]})
+                messages.append({"role": "user", "content": row[0]})
+                messages.append({"role": "assistant", "content": row[1]})
         return messages
 
-    def create_chat(self, title):
+    def get_chat_turns(self, chat_id, count_tokens):
         """
-        Creates a new chat
+        Gets the chat interactions as (user_message, model_message, token_count) tuples.
+        Rows stored without a token count are counted once with count_tokens
+        and the result is saved so the next load reuses it
         """
-        self.cursor.execute("""
-            INSERT INTO chats (user_id, title)
-            VALUES(?, ?)
-        """, (self.user_id, title,))
+        cursor = self.pool.reader().execute("""
+            SELECT id, user_message, model_message, token_count
+            FROM chat_interactions
+            WHERE chat_id = ?
+            ORDER BY message_date ASC, id ASC
+        """, (chat_id, ))
 
-        new_id = self.cursor.lastrowid
-        self.conn.commit()
-        return new_id
+        turns = []
+        missing_counts = []
+        for interaction_id, user_message, model_message, token_count in cursor.fetchall():
+            if token_count is None:
+                token_count = count_tokens(user_message) + count_tokens(model_message)
+                missing_counts.append((token_count, interaction_id))
+            turns.append((user_message, model_message, token_count))
+
+        if missing_counts:
+            with self.pool.writer() as conn:
+                conn.executemany("""
+                    UPDATE chat_interactions SET token_count = ? WHERE id = ?
+                """, missing_counts)
+        return turns
+
+    def search_interactions(self, fts_query, limit=20):
+        """
+        Searches the interactions with the FTS5 index, best matches first.
+        fts_query must already be a valid FTS5 query
+        """
+        cursor = self.pool.reader().execute("""
+            SELECT ci.id, ci.chat_id, c.title, ci.message_date,
+                snippet(chat_interactions_fts, 0, '<mark>', '</mark>', '...', 16),
+                snippet(chat_interactions_fts, 1, '<mark>', '</mark>', '...', 16),
+                bm25(chat_interactions_fts) AS rank
+            FROM chat_interactions_fts
+            JOIN chat_interactions ci ON ci.id = chat_interactions_fts.rowid
+            JOIN chats c ON c.id = ci.chat_id
+            WHERE chat_interactions_fts MATCH ? AND c.user_id = ?
+            ORDER BY rank
+            LIMIT ?
+        """, (fts_query, self.user_id, limit))
+
+        results = []
+        for row in cursor.fetchall():
+            results.append({
+                "interaction_id": row[0],
+                "chat_id": row[1],
+                "chat_title": row[2],
+                "message_date": row[3],
+                "user_snippet": row[4],
+                "model_snippet": row[5],
+                "rank": row[6]
+            })
+        return results
 
-    def store_interaction(self, chat_id, user_prompt, llm_answer):
+    def create_chat(self, title):
         """
-        Stores a new interaction between the user and the llm
+        Creates a new chat, active since it was created
         """
-        self.cursor.execute("""
-        INSERT INTO chat_interactions (chat_id, user_message, model_message)
-        VALUES (?, ?, ?)
-        """, (chat_id, user_prompt, llm_answer,))
+        date_created = current_timestamp()
+        with self.pool.writer() as conn:
+            cursor = conn.execute("""
+                INSERT INTO chats (user_id, title, date_created, last_activity)
+                VALUES(?, ?, ?, ?)
+            """, (self.user_id, title, date_created, date_created,))
+
+            new_id = cursor.lastrowid
+        return new_id
 
-        new_interaction_id = self.cursor.lastrowid
-        self.conn.commit()
+    def store_interaction(self, chat_id, user_prompt, llm_answer, token_count=None):
+        """
+        Stores a new interaction between the user and the llm.
+        The timestamp is taken in process so no extra query is needed to return it
+        """
+        message_date = current_timestamp()
+        with self.pool.writer() as conn:
+            cursor = conn.execute("""
+            INSERT INTO chat_interactions
+                (chat_id, user_message, model_message, message_date, token_count)
+            VALUES (?, ?, ?, ?, ?)
+            """, (chat_id, user_prompt, llm_answer, message_date, token_count,))
 
-        self.cursor.execute("""
-            SELECT message_date from chat_interactions WHERE id = ?
-        """, (new_interaction_id,))
-        row = self.cursor.fetchone()
+            new_interaction_id = cursor.lastrowid
 
         return {
             "id": new_interaction_id,
             "chat_id": chat_id,
             "user_message": user_prompt,
             "model_message": llm_answer,
-            "message_date": row[0] if row else None
+            "message_date": message_date
         }
 
+    def store_interactions(self, interactions):
+        """
+        Stores a batch of interactions with their ids already assigned,
+        all of them on a single transaction.
+        Interactions of a chat deleted while they were pending are skipped,
+        otherwise the foreign key would fail the whole batch
+        """
+        with self.pool.writer() as conn:
+            conn.executemany("""
+            INSERT INTO chat_interactions
+                (id, chat_id, user_message, model_message, message_date, token_count)
+            SELECT :id, :chat_id, :user_message, :model_message, :message_date, :token_count
+            WHERE EXISTS (SELECT 1 FROM chats WHERE id = :chat_id)
+            """, interactions)
+
+    def get_last_interaction_id(self):
+        """
+        Returns the highest interaction id ever assigned
+        """
+        with self.pool.writer() as conn:
+            row = conn.execute("""
+                SELECT MAX(id) FROM chat_interactions
+            """).fetchone()
+            sequence = conn.execute("""
+                SELECT seq FROM sqlite_sequence WHERE name = 'chat_interactions'
+            """).fetchone()
+        return max(row[0] or 0, sequence[0] if sequence else 0)
+
     def delete_chat(self, chat_id):
         """
-        Deletes a chat and its content
+        Deletes a chat and its content.
+        The interactions are removed by the ON DELETE CASCADE foreign key
         """
-        self.cursor.execute("""
-            DELETE FROM chat_interactions WHERE chat_id = ?
-        """, (chat_id, ))
+        with self.pool.writer() as conn:
+            conn.execute("""
+                DELETE FROM chats WHERE id = ?
+            """, (chat_id, ))
 
-        self.cursor.execute("""
-            DELETE FROM chats WHERE id = ?
-        """, (chat_id, ))
-        self.conn.commit()
+    def get_changes(self, since, limit=500):
+        """
+        Returns the changes after the since cursor, collapsed to the current
+        state of every row: the chats and interactions inserted that still
+        exist, and the ids deleted. Everything is read on one snapshot.
+        chats also lists the chats whose interactions changed, their summary
+        columns (last activity, count, preview) moved with them.
+        The interactions of a deleted chat are not listed, deleting the
+        chat on the client removes them
+        reset tells the client its cursor is older than the retained feed
+        and it has to fetch everything again
+        """
+        conn = self.pool.reader()
+        conn.execute("BEGIN")
+        try:
+            oldest = conn.execute("SELECT MIN(seq) FROM change_feed").fetchone()[0]
+            feed = conn.execute("""
+                SELECT seq, entity, entity_id, chat_id, operation
+                FROM change_feed WHERE seq > ?
+                ORDER BY seq LIMIT ?
+            """, (since, limit + 1)).fetchall()
+            has_more = len(feed) > limit
+            feed = feed[:limit]
+
+            inserted = {"chat": {}, "interaction": {}}
+            deleted = {"chat": {}, "interaction": {}}
+            summaries_changed = {}
+            for _, entity, entity_id, chat_id, operation in feed:
+                if entity == "interaction":
+                    summaries_changed[chat_id] = None
+                if operation == "insert":
+                    inserted[entity][entity_id] = None
+                    deleted[entity].pop(entity_id, None)
+                else:
+                    inserted[entity].pop(entity_id, None)
+                    deleted[entity][entity_id] = None
+
+            # Deleted chats have no row left and drop out here
+            chats = self._rows_by_id(
+                f"SELECT {self._CHAT_COLUMNS} FROM chats",
+                list(inserted["chat"].keys() | summaries_changed.keys()), conn)
+            interactions = self._rows_by_id("""
+                SELECT id, chat_id, user_message, model_message, message_date
+                FROM chat_interactions
+            """, list(inserted["interaction"]), conn)
+        finally:
+            conn.execute("COMMIT")
+
+        return {
+            "cursor": feed[-1][0] if feed else since,
+            "has_more": has_more,
+            "reset": oldest is not None and since < oldest - 1,
+            "chats": [self._chat_dict(row) for row in chats],
+            "deleted_chats": list(deleted["chat"]),
+            "interactions": [{
+                "interaction_id": row[0],
+                "chat_id": row[1],
+                "user_message": row[2],
+                "model_message": row[3],
+                "message_date": row[4]
+            } for row in interactions],
+            "deleted_interactions": list(deleted["interaction"])
+        }
+
+    @staticmethod
+    def _rows_by_id(select, ids, conn):
+        """Runs a SELECT for the rows with the given ids, in id order"""
+        if not ids:
+            return []
+        placeholders = ", ".join("?" * len(ids))
+        return conn.execute(
+            f"{select} WHERE id IN ({placeholders}) ORDER BY id", ids).fetchall()
+
+    def get_change_cursor(self):
+        """
+        Returns the newest change feed cursor, where a client that just
+        fetched everything starts syncing from
+        """
+        row = self.pool.reader().execute(
+            "SELECT MAX(seq) FROM change_feed").fetchone()
+        return row[0] or 0
+
+    def prune_change_feed(self, keep_rows):
+        """
+        Deletes the oldest changes, keeping the newest keep_rows.
+        Clients with an older cursor get reset on their next sync
+        """
+        with self.pool.writer() as conn:
+            conn.execute("""
+                DELETE FROM change_feed
+                WHERE seq <= (SELECT MAX(seq) FROM change_feed) - ?
+            """, (keep_rows, ))
 
     def close(self):
         """
-        Cierra la conexión a la base de datos
+        Cierra la conexión a la base de datos.
+        El pool compartido de la aplicación se cierra en el lifespan
         """
-        if self.conn:
-            self.conn.close()
-            print("[DB] Connection closed")
+        if self._owns_pool:
+            self.pool.close()
 
     def __enter__(self):
         """Context manager support"""
@@ -0,0 +1,112 @@
+"""
+This module contains the write-behind log for chat interactions.
+Interactions are answered right away and committed later in batches,
+so many active sockets share one fsync instead of paying one per turn
+"""
+import asyncio
+from app.db.init_db import current_timestamp
+
+
+class InteractionLog:
+    """
+    Queues new interactions and flushes them on batched transactions,
+    when batch_size interactions are pending or every flush_interval seconds.
+    Ids are assigned in process, this is safe because the app is the only
+    writer of the database file.
+    Interactions queued since the last flush are lost if the process is
+    killed, a normal shutdown flushes them from lifespan
+    """
+
+    def __init__(self, store_batch, batch_size: int = 32,
+                 flush_interval: float = 0.25):
+        """
+        :param store_batch: coroutine function that stores a list of interactions
+        """
+        self._store_batch = store_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: list[dict] = []
+        self._next_id = 1
+        self._flush_lock = asyncio.Lock()
+        self._batch_ready = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self, last_interaction_id: int):
+        """
+        Starts the background flush loop.
+        New ids continue after the last stored interaction
+        """
+        self._next_id = last_interaction_id + 1
+        self._task = asyncio.create_task(self._run())
+
+    def append(self, chat_id, user_prompt, llm_answer, token_count=None):
+        """
+        Queues an interaction and returns it as it will be stored
+        """
+        interaction = {
+            "id": self._next_id,
+            "chat_id": chat_id,
+            "user_message": user_prompt,
+            "model_message": llm_answer,
+            "message_date": current_timestamp(),
+            "token_count": token_count
+        }
+        self._next_id += 1
+        self._pending.append(interaction)
+        if len(self._pending) >= self.batch_size:
+            self._batch_ready.set()
+
+        return {key: value for key, value in interaction.items()
+                if key != "token_count"}
+
+    def discard_chat(self, chat_id):
+        """
+        Drops the pending interactions of a deleted chat
+        """
+        self._pending = [interaction for interaction in self._pending
+                         if interaction["chat_id"] != chat_id]
+
+    async def flush(self):
+        """
+        Commits every pending interaction on a single transaction.
+        Readers call it first so they always see the interactions already answered
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            try:
+                await self._store_batch(batch)
+            except Exception:
+                # Keep the order so the retry stores them before the newer ones
+                self._pending[:0] = batch
+                raise
+
+    async def _run(self):
+        """
+        Flushes when a batch is full or when the flush interval expires
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(),
+                                       timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[DB] Failed to flush interactions, retrying: {e}")
+
+    async def stop(self):
+        """
+        Stops the flush loop and commits what is still pending
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
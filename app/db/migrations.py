@@ -0,0 +1,328 @@
+"""
+This module contains the versioned schema migrations of the local database.
+The applied version is stored on PRAGMA user_version and every migration
+runs once, in order, on its own transaction
+"""
+import sqlite3
+
+
+def _baseline_schema(conn: sqlite3.Connection):
+    """Tables of the first version of the app"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_info (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      name TEXT UNIQUE NOT NULL,
+      current_model TEXT NOT NULL
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS chats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        title TEXT,
+        date_created DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES user_info(id)
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS chat_interactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER,
+        user_message TEXT,
+        model_message TEXT,
+        message_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (chat_id) REFERENCES chats(id)
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_memory_context (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        var TEXT,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+
+def _interaction_token_counts(conn: sqlite3.Connection):
+    """Cached prompt tokens of every interaction"""
+    add_column_if_missing(conn, "chat_interactions", "token_count", "INTEGER")
+
+
+def _cascade_chat_interactions(conn: sqlite3.Connection):
+    """
+    Rebuilds chat_interactions so deleting a chat deletes its interactions.
+    SQLite can not alter a foreign key, the table is copied instead
+    """
+    foreign_keys = conn.execute(
+        "PRAGMA foreign_key_list(chat_interactions)").fetchall()
+    # (id, seq, table, from, to, on_update, on_delete, match)
+    if any(fk[2] == "chats" and fk[6] == "CASCADE" for fk in foreign_keys):
+        return
+
+    conn.execute("""
+    CREATE TABLE chat_interactions_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER,
+        user_message TEXT,
+        model_message TEXT,
+        message_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+        token_count INTEGER,
+        FOREIGN KEY (chat_id) REFERENCES chats(id) ON DELETE CASCADE
+    )
+    """)
+    conn.execute("""
+    INSERT INTO chat_interactions_new
+        (id, chat_id, user_message, model_message, message_date, token_count)
+    SELECT id, chat_id, user_message, model_message, message_date, token_count
+    FROM chat_interactions
+    """)
+    conn.execute("DROP TABLE chat_interactions")
+    conn.execute(
+        "ALTER TABLE chat_interactions_new RENAME TO chat_interactions")
+
+
+def _chat_history_indexes(conn: sqlite3.Connection):
+    """
+    Loading a chat becomes an index range scan already sorted by date.
+    The (chat_id, message_date) index also serves lookups by chat_id alone
+    """
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_chat_interactions_chat_date
+    ON chat_interactions (chat_id, message_date)
+    """)
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_chats_user
+    ON chats (user_id)
+    """)
+
+
+def _chat_interactions_search(conn: sqlite3.Connection):
+    """
+    Full text index over the interaction messages.
+    It is an external content FTS5 table, the text is only stored once on
+    chat_interactions and the triggers keep the index in sync
+    """
+    conn.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS chat_interactions_fts USING fts5(
+        user_message,
+        model_message,
+        content='chat_interactions',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS chat_interactions_fts_insert
+    AFTER INSERT ON chat_interactions BEGIN
+        INSERT INTO chat_interactions_fts (rowid, user_message, model_message)
+        VALUES (new.id, new.user_message, new.model_message);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS chat_interactions_fts_delete
+    AFTER DELETE ON chat_interactions BEGIN
+        INSERT INTO chat_interactions_fts
+            (chat_interactions_fts, rowid, user_message, model_message)
+        VALUES ('delete', old.id, old.user_message, old.model_message);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS chat_interactions_fts_update
+    AFTER UPDATE OF user_message, model_message ON chat_interactions BEGIN
+        INSERT INTO chat_interactions_fts
+            (chat_interactions_fts, rowid, user_message, model_message)
+        VALUES ('delete', old.id, old.user_message, old.model_message);
+        INSERT INTO chat_interactions_fts (rowid, user_message, model_message)
+        VALUES (new.id, new.user_message, new.model_message);
+    END
+    """)
+    # One time backfill of the interactions stored before the index existed
+    conn.execute(
+        "INSERT INTO chat_interactions_fts (chat_interactions_fts) VALUES ('rebuild')")
+
+
+def _memory_embeddings(conn: sqlite3.Connection):
+    """
+    Memories store their embedding as a float32 BLOB and the model that
+    produced it, so they are only embedded again when the model changes
+    """
+    add_column_if_missing(conn, "user_memory_context", "embedding", "BLOB")
+    add_column_if_missing(conn, "user_memory_context", "embedding_model", "TEXT")
+
+
+def _change_feed(conn: sqlite3.Connection):
+    """
+    Ordered log of the chats and interactions inserted or deleted, so clients
+    can catch up from a cursor (seq) instead of fetching everything again.
+    Interactions deleted with their chat are not logged one by one, the
+    chat delete covers them
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS change_feed (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        entity TEXT NOT NULL,
+        entity_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        operation TEXT NOT NULL
+    )
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS chats_change_insert
+    AFTER INSERT ON chats BEGIN
+        INSERT INTO change_feed (entity, entity_id, chat_id, operation)
+        VALUES ('chat', new.id, new.id, 'insert');
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS chats_change_delete
+    AFTER DELETE ON chats BEGIN
+        INSERT INTO change_feed (entity, entity_id, chat_id, operation)
+        VALUES ('chat', old.id, old.id, 'delete');
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS chat_interactions_change_insert
+    AFTER INSERT ON chat_interactions BEGIN
+        INSERT INTO change_feed (entity, entity_id, chat_id, operation)
+        VALUES ('interaction', new.id, new.chat_id, 'insert');
+    END
+    """)
+    # The cascade of a chat delete runs after the chat row is gone
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS chat_interactions_change_delete
+    AFTER DELETE ON chat_interactions
+    WHEN EXISTS (SELECT 1 FROM chats WHERE id = old.chat_id) BEGIN
+        INSERT INTO change_feed (entity, entity_id, chat_id, operation)
+        VALUES ('interaction', old.id, old.chat_id, 'delete');
+    END
+    """)
+
+
+def _chat_summaries(conn: sqlite3.Connection):
+    """
+    Summary of every chat stored on the chat row: last activity, message
+    count and a preview of the last answer, so listing chats never
+    aggregates chat_interactions.
+    Triggers keep them up to date, a delete finds the new last interaction
+    through the (chat_id, message_date) index
+    """
+    add_column_if_missing(conn, "chats", "last_activity", "DATETIME")
+    add_column_if_missing(conn, "chats", "message_count",
+                          "INTEGER NOT NULL DEFAULT 0")
+    add_column_if_missing(conn, "chats", "preview", "TEXT")
+
+    conn.execute("""
+    UPDATE chats SET
+        message_count = (SELECT COUNT(*) FROM chat_interactions
+                         WHERE chat_id = chats.id),
+        last_activity = COALESCE((SELECT MAX(message_date) FROM chat_interactions
+                                  WHERE chat_id = chats.id), date_created),
+        preview = (SELECT substr(model_message, 1, 120) FROM chat_interactions
+                   WHERE chat_id = chats.id
+                   ORDER BY message_date DESC, id DESC LIMIT 1)
+    """)
+    # SET expressions read the row as it was before the update
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS chat_interactions_summary_insert
+    AFTER INSERT ON chat_interactions BEGIN
+        UPDATE chats SET
+            message_count = message_count + 1,
+            preview = CASE WHEN new.message_date >= COALESCE(last_activity, '')
+                      THEN substr(new.model_message, 1, 120) ELSE preview END,
+            last_activity = MAX(COALESCE(last_activity, ''), new.message_date)
+        WHERE id = new.chat_id;
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS chat_interactions_summary_delete
+    AFTER DELETE ON chat_interactions BEGIN
+        UPDATE chats SET
+            message_count = message_count - 1,
+            last_activity = COALESCE(
+                (SELECT message_date FROM chat_interactions
+                 WHERE chat_id = old.chat_id
+                 ORDER BY message_date DESC, id DESC LIMIT 1),
+                date_created),
+            preview = (SELECT substr(model_message, 1, 120) FROM chat_interactions
+                       WHERE chat_id = old.chat_id
+                       ORDER BY message_date DESC, id DESC LIMIT 1)
+        WHERE id = old.chat_id;
+    END
+    """)
+    # The id breaks ties so the keyset listing is a plain index scan.
+    # It also covers lookups by user_id, the old index is not needed anymore
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_chats_user_activity
+    ON chats (user_id, last_activity DESC, id DESC)
+    """)
+    conn.execute("DROP INDEX IF EXISTS idx_chats_user")
+
+
+# (version, description, migration) in the order they must be applied.
+# Never edit or reorder an applied migration, append a new one instead
+MIGRATIONS = [
+    (1, "baseline schema", _baseline_schema),
+    (2, "interaction token counts", _interaction_token_counts),
+    (3, "cascade chat interactions on chat delete", _cascade_chat_interactions),
+    (4, "chat history indexes", _chat_history_indexes),
+    (5, "chat interactions full text search", _chat_interactions_search),
+    (6, "user memory embeddings", _memory_embeddings),
+    (7, "chat change feed", _change_feed),
+    (8, "chat summary columns", _chat_summaries),
+]
+
+
+def add_column_if_missing(conn: sqlite3.Connection, table: str, column: str,
+                          definition: str):
+    """Adds a column to databases created before the column existed"""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Returns the schema version stored on the database file"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn: sqlite3.Connection) -> int:
+    """
+    Applies every pending migration and returns the resulting schema version.
+    Foreign keys are disabled while migrating because table rebuilds drop
+    tables other tables point to, and verified before each commit
+    """
+    current_version = get_schema_version(conn)
+    pending = [migration for migration in MIGRATIONS
+               if migration[0] > current_version]
+    if not pending:
+        return current_version
+
+    isolation_level = conn.isolation_level
+    conn.commit()
+    conn.isolation_level = None
+    conn.execute("PRAGMA foreign_keys=OFF")
+    try:
+        for version, description, migration in pending:
+            conn.execute("BEGIN")
+            try:
+                migration(conn)
+                violations = conn.execute("PRAGMA foreign_key_check").fetchall()
+                if violations:
+                    raise sqlite3.IntegrityError(
+                        f"Migration {version} left {len(violations)} broken foreign keys")
+                # user_version is transactional, it is only saved with the migration
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            current_version = version
+            print(f"[DB] Applied migration {version}: {description}")
+    finally:
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.isolation_level = isolation_level
+
+    return current_version
@@ -21,6 +21,16 @@ class LLMNotLoadedException(AureliusException):
         )
 
 
+class ModelNotReadyException(AureliusException):
+    def __init__(self, model: str, detail: str):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            success=False,
+            message=f"{model} not loaded",
+            detail=detail
+        )
+
+
 class TTSException(AureliusException):
     def __init__(self, detail: str):
         super().__init__(
@@ -65,6 +75,16 @@ class NotFoundException(AureliusException):
         )
 
 
+class BadRequestException(AureliusException):
+    def __init__(self, detail: str):
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            success=False,
+            message=detail,
+            detail=detail
+        )
+
+
 async def socket_exeption_handling(
         ws: WebSocket,
         error_type: str,
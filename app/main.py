@@ -4,6 +4,7 @@ This module is the entrypoint for the backed of aurelius desktop app
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.text_router import text_router
+from app.api.voice_router import voice_router
 from app.api.user_router import user_router
 from app.api.chats_router import chats_router
 from app.api.health_router import health_router
@@ -23,8 +24,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 app.include_router(health_router)
 app.include_router(text_router)
+app.include_router(voice_router)
 app.include_router(user_router)
 app.include_router(chats_router)
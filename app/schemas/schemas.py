@@ -19,3 +19,8 @@ class UserSetup(BaseModel):
     """To register the local user for the first time"""
     user_name: str
     model: str
+
+
+class UserMemory(BaseModel):
+    """To save something the assistant should remember about the user"""
+    memory: str
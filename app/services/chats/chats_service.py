@@ -2,7 +2,63 @@
 This module contains a class that handles all the http chat methods
 """
 
-from app.db.init_db import AureliusDB
+import base64
+import binascii
+import json
+from fastapi import Depends
+from app.db.async_repository import AsyncAureliusDB
+from app.exceptions.exception_handling import BadRequestException
+from app.utils.model_loading.model_loading import aurelius_models, get_database
+
+
+def _page(items, limit, after, newest_first=False):
+    """
+    Trims a page fetched with limit + 1 rows and tells if there are more.
+    Pages after a cursor grow towards newer rows, the rest towards older
+    ones. The extra row is at the end of the list when it grows that way
+    """
+    if limit is None or len(items) <= limit:
+        return items, False
+    if (after is not None) != newest_first:
+        return items[:limit], True
+    return items[1:], True
+
+
+def _encode_chat_cursor(chat):
+    """
+    Returns the opaque pagination cursor of a listed chat,
+    its (last_activity, chat id) sort key
+    """
+    key = json.dumps([chat["last_activity"], chat["chat_id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(key.encode("utf-8")).decode("ascii")
+
+
+def _decode_chat_cursor(cursor):
+    """
+    Returns the (last_activity, chat id) sort key of a cursor
+    """
+    if cursor is None:
+        return None
+    try:
+        last_activity, chat_id = json.loads(base64.urlsafe_b64decode(cursor))
+    except (ValueError, TypeError, binascii.Error):
+        raise BadRequestException("Invalid chat cursor") from None
+    if not isinstance(last_activity, str) or not isinstance(chat_id, int):
+        raise BadRequestException("Invalid chat cursor")
+    return last_activity, chat_id
+
+
+def _fts_query(text):
+    """
+    Turns the user search text into a FTS5 query.
+    Every word is quoted so punctuation is never read as FTS5 syntax,
+    and the last one matches as a prefix to support search as you type
+    """
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if not terms:
+        return None
+    terms[-1] += "*"
+    return " ".join(terms)
 
 
 class ChatsService:
@@ -10,22 +66,100 @@ class ChatsService:
     This class contains all the methods for http chat services
     """
 
-    def __init__(self):
-        self.database = AureliusDB()
+    def __init__(self, database: AsyncAureliusDB = Depends(get_database)):
+        self.database = database
+
+    @staticmethod
+    def _validate_cursor(before, after):
+        if before is not None and after is not None:
+            raise BadRequestException("Use either before or after, not both")
 
-    def get_user_chats(self):
+    def chats_etag(self):
         """
-        Returns all the stored chats
+        Returns the ETag of the chat list, taken before reading it so a
+        change made during the read is never hidden behind the old ETag
         """
-        chats = self.database.get_user_chats()
-        return chats
+        return self.database.versions.list_etag()
 
-    def get_user_chat_content(self, chat_id):
+    def chat_content_etag(self, chat_id):
         """
-        Returns all the stored content from one chat
+        Returns the ETag of a chat content
         """
-        chat_content = self.database.get_chat_content(chat_id=chat_id)
-        return chat_content
+        return self.database.versions.chat_etag(chat_id)
 
-    def delete_chat(self, chat_id):
-        self.database.delete_chat(chat_id=chat_id)
+    async def get_user_chats(self, before=None, after=None, limit=None):
+        """
+        Returns the stored chats most recently active first, a page of them
+        when limit is provided.
+        Every chat carries the cursor to pass as before or after.
+        Also returns if there are more chats past the page
+        """
+        self._validate_cursor(before, after)
+        chats = await self.database.get_user_chats(
+            before=_decode_chat_cursor(before), after=_decode_chat_cursor(after),
+            limit=None if limit is None else limit + 1)
+        for chat in chats:
+            chat["cursor"] = _encode_chat_cursor(chat)
+        return _page(chats, limit, after, newest_first=True)
+
+    async def get_user_chat_content(self, chat_id, before=None, after=None, limit=None):
+        """
+        Returns the stored content from one chat, a page of it when limit is provided.
+        Also returns if there are more messages past the page
+        """
+        self._validate_cursor(before, after)
+        chat_content = await self.database.get_chat_content(
+            chat_id=chat_id, before=before, after=after,
+            limit=None if limit is None else limit + 1)
+        return _page(chat_content, limit, after)
+
+    def prefetch_chat(self, chat_id):
+        """
+        Starts warming the llm prompt cache with the chat history
+        """
+        llm_service = aurelius_models.get('llm')
+        if llm_service is not None:
+            llm_service.prefetch_chat(chat_id)
+
+    async def stream_user_chat_content(self, chat_id, batch_size=200):
+        """
+        Yields the chat content as NDJSON, one message per line,
+        reading the rows in batches instead of loading the whole chat
+        """
+        async for batch in self.database.iter_chat_content(chat_id=chat_id,
+                                                           batch_size=batch_size):
+            yield "".join(json.dumps(message) + "\n" for message in batch)
+
+    async def sync_chats(self, since=None, limit=500):
+        """
+        Returns the changes after the since cursor with the cursor to use next.
+        Without since only the current cursor is returned, clients call it
+        right after fetching everything
+        """
+        if since is None:
+            return {"cursor": await self.database.get_change_cursor(),
+                    "has_more": False, "reset": False,
+                    "chats": [], "deleted_chats": [],
+                    "interactions": [], "deleted_interactions": []}
+        if since < 0:
+            raise BadRequestException("The sync cursor can not be negative")
+        return await self.database.get_changes(since, limit=limit)
+
+    async def search_chats(self, text, limit=20):
+        """
+        Searches all the chats, returns the best ranked interactions
+        with highlighted snippets
+        """
+        fts_query = _fts_query(text)
+        if fts_query is None:
+            raise BadRequestException("The search text can not be empty")
+        return await self.database.search_interactions(fts_query, limit=limit)
+
+    async def delete_chat(self, chat_id):
+        """
+        Deletes a chat and drops its in-memory conversation session
+        """
+        await self.database.delete_chat(chat_id=chat_id)
+        llm_service = aurelius_models.get('llm')
+        if llm_service is not None:
+            llm_service.sessions.discard(chat_id)
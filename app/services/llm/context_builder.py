@@ -0,0 +1,171 @@
+"""
+This module contains the context window builder used before every prompt.
+It fits the chat history into a token budget per model so long chats never
+go past the model context
+"""
+
+import os
+
+# Ollama does not expose the model tokenizer, so prompts are estimated with the
+# usual ~4 characters per token plus the chat template overhead of each message
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+DEFAULT_CONTEXT_TOKENS = 4096
+DEFAULT_RESPONSE_TOKENS = 1024
+# Part of the history budget that can be spent on the recap of dropped turns
+RECAP_SHARE = 0.1
+RECAP_QUESTION_CHARS = 80
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the tokens a message takes on the prompt
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+def parse_model_context_tokens(value: str) -> tuple[int | None, dict[str, int]]:
+    """
+    Parses the AURELIUS_CONTEXT_TOKENS variable.
+    It accepts a global value ("8192"), per model values ("llama3=8192,mistral=4096")
+    or both ("8192,mistral=4096")
+    """
+    default = None
+    per_model = {}
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if "=" in item:
+            model, tokens = item.rsplit("=", 1)
+            per_model[model.strip()] = int(tokens)
+        else:
+            default = int(item)
+    return default, per_model
+
+
+class ContextBuilder:
+    """
+    Builds the ollama message list for a prompt inside the model token budget.
+    The system prompt, the new user prompt and the newest turns are always kept,
+    older turns are dropped and collapsed into a short recap of their questions
+    """
+
+    def __init__(self, default_context_tokens: int = DEFAULT_CONTEXT_TOKENS,
+                 response_tokens: int = DEFAULT_RESPONSE_TOKENS,
+                 model_context_tokens: dict[str, int] | None = None):
+        self.default_context_tokens = default_context_tokens
+        self.response_tokens = response_tokens
+        self.model_context_tokens = model_context_tokens or {}
+
+    @classmethod
+    def from_env(cls):
+        """
+        Creates the builder using AURELIUS_CONTEXT_TOKENS and AURELIUS_RESPONSE_TOKENS
+        """
+        default, per_model = parse_model_context_tokens(
+            os.getenv('AURELIUS_CONTEXT_TOKENS', ''))
+        return cls(
+            default_context_tokens=default or DEFAULT_CONTEXT_TOKENS,
+            response_tokens=int(os.getenv('AURELIUS_RESPONSE_TOKENS',
+                                          str(DEFAULT_RESPONSE_TOKENS))),
+            model_context_tokens=per_model)
+
+    def context_tokens(self, model: str) -> int:
+        """
+        Returns the context window configured for a model.
+        "llama3" matches "llama3:8b" and any other tag of the same model
+        """
+        if model in self.model_context_tokens:
+            return self.model_context_tokens[model]
+        base_name = model.split(":", 1)[0]
+        return self.model_context_tokens.get(base_name, self.default_context_tokens)
+
+    def build(self, model: str, system_prompt: dict, turns: list,
+              user_prompt: str, context_prompt: dict | None = None) -> list[dict]:
+        """
+        Returns the message list for ollama.
+        turns are the session ChatTurn records, their token_count is cached
+        so this only walks the turns that actually fit.
+        context_prompt is an optional system message for this prompt only,
+        like the user memories relevant to it. It goes right before the prompt
+        so the start of the conversation stays the same between turns
+        """
+        reserved = estimate_tokens(user_prompt)
+        if context_prompt is not None:
+            reserved += estimate_tokens(context_prompt["content"])
+
+        messages = self.build_prefix(model, system_prompt, turns, reserved)
+        if context_prompt is not None:
+            messages.append(context_prompt)
+        messages.append({"role": "user", "content": user_prompt})
+        return messages
+
+    def build_prefix(self, model: str, system_prompt: dict, turns: list,
+                     reserved_tokens: int) -> list[dict]:
+        """
+        Returns the system prompt and the history that fit on the budget,
+        leaving reserved_tokens for the messages of the new prompt
+        """
+        available = (self.context_tokens(model) - self.response_tokens
+                     - estimate_tokens(system_prompt["content"]))
+        budget = available - reserved_tokens
+        first_kept = self._first_fitting_turn(turns, budget)
+
+        messages = [system_prompt]
+        if first_kept > 0:
+            # The recap budget does not depend on the new prompt, so the recap
+            # and the prompt prefix Ollama caches stay the same between requests
+            recap_budget = int(available * RECAP_SHARE)
+            first_kept = self._first_fitting_turn(turns, budget - recap_budget)
+            recap = self._recap(turns[:first_kept], recap_budget)
+            if recap is not None:
+                messages.append(recap)
+
+        for turn in turns[first_kept:]:
+            messages.append({"role": "user", "content": turn.user_message})
+            messages.append(
+                {"role": "assistant", "content": turn.model_message})
+        return messages
+
+    @staticmethod
+    def _first_fitting_turn(turns: list, budget: int) -> int:
+        """
+        Returns the index of the oldest turn kept when the newest turns
+        are added until the budget is full
+        """
+        first_kept = len(turns)
+        used = 0
+        while first_kept > 0:
+            turn_tokens = turns[first_kept - 1].token_count
+            if used + turn_tokens > budget:
+                break
+            used += turn_tokens
+            first_kept -= 1
+        return first_kept
+
+    def _recap(self, dropped_turns: list, budget: int) -> dict | None:
+        """
+        Collapses the dropped turns into a system note with the most recent
+        questions that fit on the budget
+        """
+        header = (f"{len(dropped_turns)} earlier interactions of this chat were "
+                  "omitted. Latest earlier questions from the user:")
+        used = estimate_tokens(header)
+        if used > budget:
+            return None
+
+        questions = []
+        for turn in reversed(dropped_turns):
+            question = " ".join(turn.user_message.split())[:RECAP_QUESTION_CHARS]
+            line = f"- {question}"
+            line_tokens = estimate_tokens(line) - MESSAGE_OVERHEAD_TOKENS
+            if used + line_tokens > budget:
+                break
+            used += line_tokens
+            questions.append(line)
+
+        if not questions:
+            return None
+        questions.reverse()
+        return {"role": "system", "content": "\n".join([header] + questions)}
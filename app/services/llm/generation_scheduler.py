@@ -0,0 +1,114 @@
+"""
+This module contains the scheduler of the llm generations.
+Every model runs a bounded number of generations at a time, the rest wait
+on a FIFO queue instead of piling up on Ollama
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+DEFAULT_WORKERS_PER_MODEL = 1
+
+
+class _ModelQueue:
+    """
+    Running generations and waiting requests of a model
+    """
+    __slots__ = ("workers", "active", "waiting", "changed")
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.active = 0
+        self.waiting: deque = deque()
+        self.changed = asyncio.Event()
+
+    def has_free_slot(self) -> bool:
+        return self.active < self.workers
+
+    def notify(self):
+        """Wakes the waiting requests so they check their position"""
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class GenerationScheduler:
+    """
+    Limits the concurrent generations per model (AURELIUS_GENERATION_WORKERS).
+    Requests get a slot in arrival order. While they wait they are told
+    their position on the queue, and a cancelled request leaves the queue
+    or frees its slot right away.
+    Everything runs on the event loop, so the bookkeeping needs no locks
+    """
+
+    def __init__(self, workers_per_model: int | None = None):
+        self.workers_per_model = workers_per_model or int(os.getenv(
+            'AURELIUS_GENERATION_WORKERS', str(DEFAULT_WORKERS_PER_MODEL)))
+        self._queues: dict[str, _ModelQueue] = {}
+
+    def _queue(self, model: str) -> _ModelQueue:
+        queue = self._queues.get(model)
+        if queue is None:
+            queue = _ModelQueue(self.workers_per_model)
+            self._queues[model] = queue
+        return queue
+
+    async def acquire(self, model: str, on_position=None) -> float:
+        """
+        Waits for a generation slot of the model and returns the seconds waited.
+        on_position is an optional coroutine function called with the
+        position on the queue every time it changes
+        """
+        queue = self._queue(model)
+        if not queue.waiting and queue.has_free_slot():
+            queue.active += 1
+            return 0.0
+
+        ticket = object()
+        queue.waiting.append(ticket)
+        enqueued_at = time.monotonic()
+        reported = None
+        try:
+            while queue.waiting[0] is not ticket or not queue.has_free_slot():
+                position = queue.waiting.index(ticket) + 1
+                changed = queue.changed
+                if on_position is not None and position != reported:
+                    reported = position
+                    await on_position(position)
+                    # The queue may have moved while the position was sent
+                    continue
+                await changed.wait()
+        finally:
+            queue.waiting.remove(ticket)
+            queue.notify()
+        queue.active += 1
+        return time.monotonic() - enqueued_at
+
+    def try_acquire(self, model: str) -> bool:
+        """
+        Takes a slot only when one is free and nobody is waiting, for low
+        priority work that should never delay a user request
+        """
+        queue = self._queue(model)
+        if queue.waiting or not queue.has_free_slot():
+            return False
+        queue.active += 1
+        return True
+
+    def release(self, model: str):
+        """Frees a slot and lets the next request in"""
+        queue = self._queues[model]
+        queue.active -= 1
+        queue.notify()
+
+    @asynccontextmanager
+    async def slot(self, model: str, on_position=None):
+        """
+        Holds a generation slot of the model, yields the seconds waited
+        """
+        waited = await self.acquire(model, on_position)
+        try:
+            yield waited
+        finally:
+            self.release(model)
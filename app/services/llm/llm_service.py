@@ -2,12 +2,26 @@
 This module contains a class designed to handle all the services related with llm
 """
 
+import asyncio
+import os
 import re
-from typing import Iterator
-from fastapi import WebSocket
-from ollama import chat, ChatResponse
-from app.db.init_db import AureliusDB
+from typing import AsyncIterator
+from ollama import AsyncClient, ChatResponse, ResponseError
+from app.db.async_repository import AsyncAureliusDB
+from app.services.ollama.ollama_status import OllamaStatus
+from app.services.ollama.model_residency import ModelResidency
+from app.services.memory.memory_service import MemoryService
+from app.services.tts.tts_service import TTSService
+from app.services.tts.voice_pipeline import VoicePipeline
 from app.exceptions.exception_handling import socket_exeption_handling
+from app.services.llm.session_manager import SessionManager, ChatSession, ChatTurn
+from app.services.llm.context_builder import ContextBuilder, estimate_tokens
+from app.services.llm.generation_scheduler import GenerationScheduler
+from app.utils.socket_channel.socket_channel import SocketChannel
+
+# Tokens left for a typical next prompt and its memories when a chat is
+# prefetched, so the history kept matches the one of the real request
+PREFETCH_RESERVED_TOKENS = 256
 
 
 class LLMService:
@@ -15,105 +29,283 @@ class LLMService:
     Integrates all the code to handle requests and answers from the llm
     """
 
-    def __init__(self):
-        self.db_context = AureliusDB()
+    def __init__(self, database: AsyncAureliusDB, ollama_status: OllamaStatus,
+                 memory: MemoryService, tts: TTSService | None = None):
+        self.db_context = database
+        self.ollama_status = ollama_status
+        self.memory = memory
+        self.tts = tts
+        self.ollama_client = AsyncClient()
         self.sentence_separator = re.compile(
             r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|!)\s+')
-        self.messages = []
-        self.current_chat = 0
+        self.sessions = SessionManager(
+            max_sessions=int(os.getenv('AURELIUS_MAX_SESSIONS', '32')),
+            max_chars=int(os.getenv('AURELIUS_SESSION_MAX_CHARS', '8000000')))
+        self.context_builder = ContextBuilder.from_env()
+        self.residency = ModelResidency(self.ollama_client, ollama_status,
+                                        self.context_builder)
+        self.scheduler = GenerationScheduler()
+        self._system_prompt = None
+        self._system_prompt_user = None
+        self._prefetch_task: asyncio.Task | None = None
+        self._prefetch_chat_id: int | None = None
+
+    async def warm_up(self):
+        """
+        Loads the user model on Ollama before the first prompt
+        """
+        user_model = await self.db_context.get_user_model()
+        if user_model:
+            await self.residency.activate(user_model)
 
     async def assemble_prompt(self, user_prompt,
-                              websocket: WebSocket,
+                              websocket: SocketChannel,
                               chat_id: int,
-                              use_voice: bool):
+                              use_voice: bool,
+                              on_chat_created=None):
         """
-        retrieves all the user context and generates the prompt for the llm
+        retrieves all the user context and generates the prompt for the llm.
+        Returns the chat id the interaction was stored on, which is a new one
+        when chat_id is 0. on_chat_created is called with the new id as soon
+        as the chat exists, a cancel after that point still knows it.
+        With use_voice the answer is also spoken, sentence by sentence.
+        The generation waits for a slot of the model on the scheduler, the
+        client gets 'queued' frames with its position meanwhile.
+        Cancelling the call aborts the Ollama stream and frees the slot
         """
 
-        user_model = self.db_context.get_user_model()
-        user_context_dict = self.retrieve_user_context()
-        if len(self.messages) == 0:
-            self.messages.append(user_context_dict)
-        else:
-            self.messages[0] = user_context_dict
+        if not await self.ollama_status.is_available():
+            # Fail fast instead of waiting for the connection to time out
+            await socket_exeption_handling(
+                ws=websocket, error_type="error",
+                message="An error occured on LLM Service, try to open Ollama",
+                details="Ollama is not running")
+            return chat_id
+
+        self.cancel_prefetch(keep_chat_id=chat_id)
+        user_model = await self.db_context.get_user_model()
+        self.residency.use(user_model)
+        system_prompt = await self.retrieve_user_context()
+        memory_prompt = await self.retrieve_relevant_memories(user_prompt)
+        session = await self.get_session(chat_id)
+
+        async def send_queue_position(position: int):
+            await websocket.send_json({
+                "message": {"position": position},
+                "type": "queued"
+            })
+
+        async with session.lock:
+            messages = self.context_builder.build(
+                user_model, system_prompt, session.turns, user_prompt,
+                context_prompt=memory_prompt)
+            voice = None
+            try:
+                async with self.scheduler.slot(user_model,
+                                               send_queue_position) as waited:
+                    if waited:
+                        await websocket.send_json({
+                            "message": {"queue_wait_ms": round(waited * 1000)},
+                            "type": "started"
+                        })
+                    if use_voice and self.tts is not None:
+                        voice = VoicePipeline(self.tts, websocket,
+                                              self.sentence_separator)
+                    generation = await self.generate_response_text_mode(
+                        user_model, messages=messages, websocket=websocket,
+                        voice=voice)
+                if generation is None:
+                    return session.chat_id
+
+                answer, answer_tokens = generation
+                token_count = estimate_tokens(user_prompt) + answer_tokens
+                await self.store_and_send_interaction(
+                    session, user_prompt, answer, token_count, websocket=websocket,
+                    on_chat_created=on_chat_created)
+
+                if voice is not None:
+                    await voice.finish()
+                    voice = None
+            finally:
+                if voice is not None:
+                    voice.cancel()
+
+        return session.chat_id
+
+    async def get_session(self, chat_id: int) -> ChatSession:
+        """
+        Returns the conversation session of a chat, loading its history from
+        the database when the chat is not in memory. Concurrent callers
+        always get the same session.
+        Chat 0 is a new chat, its session is registered once the chat is created
+        """
+        if chat_id == 0:
+            return ChatSession(chat_id=0)
 
-        if chat_id != self.current_chat:
-            self.current_chat = chat_id
-            self.messages[0] = user_context_dict
-            chat_messages = self.db_context.get_chat_content_ollama(
-                chat_id=chat_id)
-            self.messages += chat_messages
+        session = self.sessions.get(chat_id)
+        if session is None:
+            turns = [ChatTurn(user_message, model_message, token_count)
+                     for user_message, model_message, token_count
+                     in await self.db_context.get_chat_turns(
+                         chat_id=chat_id, count_tokens=estimate_tokens)]
+            # Another caller may have loaded the chat during the await, all
+            # of them must share its session and its lock
+            session = self.sessions.get(chat_id)
+            if session is None:
+                session = ChatSession(chat_id=chat_id, turns=turns)
+                self.sessions.put(session)
+        return session
 
-        self.messages += [
-            {
-                "role": "user",
-                "content": user_prompt
-            }
-        ]
+    def prefetch_chat(self, chat_id: int):
+        """
+        Warms the Ollama prompt cache with the history of a chat the user just
+        opened, so the first reply does not evaluate the whole chat again.
+        Opening another chat cancels the previous prefetch
+        """
+        if chat_id == self._prefetch_chat_id and self._prefetch_task is not None \
+                and not self._prefetch_task.done():
+            return
+        self.cancel_prefetch()
+        self._prefetch_chat_id = chat_id
+        self._prefetch_task = asyncio.create_task(self._prefetch(chat_id))
 
-        await self.generate_response_text_mode(user_model, websocket=websocket)
+    def cancel_prefetch(self, keep_chat_id: int | None = None):
+        """
+        Stops the running prefetch unless it is for keep_chat_id.
+        Closing the request makes Ollama stop evaluating the prompt
+        """
+        if self._prefetch_task is None or self._prefetch_chat_id == keep_chat_id:
+            return
+        self._prefetch_task.cancel()
+        self._prefetch_task = None
+        self._prefetch_chat_id = None
 
-        return True
+    async def _prefetch(self, chat_id: int):
+        """
+        Sends the chat prefix, the system prompt and the history kept by the
+        context builder, asking for a single token.
+        It holds a generation slot like any other request, so the workers
+        per model stay bounded, but it is skipped when the model is busy
+        """
+        try:
+            if not await self.ollama_status.is_available():
+                return
+            user_model = await self.db_context.get_user_model()
+            if not user_model:
+                return
+            self.residency.use(user_model)
+            system_prompt = await self.retrieve_user_context()
+            session = await self.get_session(chat_id)
+            if session.lock.locked():
+                # A prompt of this chat is being answered, the cache is warm
+                return
+            messages = self.context_builder.build_prefix(
+                user_model, system_prompt, session.turns, PREFETCH_RESERVED_TOKENS)
+            # Low priority: only on a free slot of the model. A prompt of this
+            # chat waits for it on the scheduler, other prompts cancel it
+            if not self.scheduler.try_acquire(user_model):
+                return
+            try:
+                await self.ollama_client.chat(
+                    model=user_model, messages=messages, stream=False,
+                    keep_alive=self.residency.keep_alive,
+                    options={"num_ctx": self.context_builder.context_tokens(user_model),
+                             "num_predict": 1})
+            finally:
+                self.scheduler.release(user_model)
+        except (ConnectionError, TimeoutError, ValueError, RuntimeError,
+                ResponseError) as e:
+            print(f"[LLM] Prefetch of chat {chat_id} failed: {e}")
 
-    async def generate_response_text_mode(self, model, websocket: WebSocket):
+    async def generate_response_text_mode(self, model, messages: list[dict],
+                                          websocket: SocketChannel,
+                                          voice: VoicePipeline | None = None):
         """
-        Generates the llm response for the user using chunks and the TTS model provided
+        Generates the llm response for the user, streaming every delta to the
+        websocket as a token frame while Ollama produces it.
+        When a voice pipeline is provided every delta is also fed to it.
+        The async client keeps the event loop free during the whole generation.
+        Returns the complete answer with its token count, or None when the
+        generation failed
         """
         try:
 
-            response: Iterator[ChatResponse] = chat(model=model, messages=self.messages,
-                                                    stream=True)
-            answer = ""
+            response: AsyncIterator[ChatResponse] = await self.ollama_client.chat(
+                model=model, messages=messages, stream=True,
+                keep_alive=self.residency.keep_alive,
+                options={"num_ctx": self.context_builder.context_tokens(model)})
+            answer_parts = []
+            answer_tokens = None
 
-            for chunk in response:
+            async for chunk in response:
+                if chunk.done:
+                    answer_tokens = chunk.eval_count
                 response_text = chunk.message.content
-                answer += response_text
-
-            self.messages += [
-                {'role': 'assistant', 'content': answer},
-            ]
+                if not response_text:
+                    continue
+                answer_parts.append(response_text)
+                if voice is not None:
+                    voice.feed(response_text)
+                await websocket.send_json({
+                    "message": response_text,
+                    "type": "token"
+                })
 
-            await self.store_and_send_interaction(
-                self.messages[-2], answer, websocket=websocket)
+            answer = "".join(answer_parts)
+            if answer_tokens is None:
+                answer_tokens = estimate_tokens(answer)
+            return answer, answer_tokens
 
-        except (ConnectionError, TimeoutError, ValueError, RuntimeError) as e:
+        except (ConnectionError, TimeoutError, ValueError, RuntimeError,
+                ResponseError) as e:
             await socket_exeption_handling(
                 ws=websocket, error_type="error",
                 message="An error occured on LLM Service, try to open Ollama",
                 details=str(e))
+            return None
 
     async def store_and_send_interaction(self,
-                                         user_prompt,
+                                         session: ChatSession,
+                                         user_message,
                                          llm_answer,
-                                         websocket: WebSocket):
+                                         token_count: int,
+                                         websocket: SocketChannel,
+                                         on_chat_created=None):
         """
         Stores a new interaction of a chat onto the local database
         """
-        user_message = user_prompt['content']
-
-        if self.current_chat == 0:
+        if session.chat_id == 0:
             title = f"{user_message[:30]}..."
             print("Titulo de nuevo chat", title)
-            new_chat_id = self.db_context.create_chat(title=title)
-            self.current_chat = new_chat_id
+            session.chat_id = await self.db_context.create_chat(title=title)
+            self.sessions.put(session)
+            if on_chat_created is not None:
+                on_chat_created(session.chat_id)
 
-        interaction_info = self.db_context.store_interaction(
-            chat_id=self.current_chat, user_prompt=user_message, llm_answer=llm_answer)
+        interaction_info = await self.db_context.store_interaction(
+            chat_id=session.chat_id, user_prompt=user_message, llm_answer=llm_answer,
+            token_count=token_count)
+        self.sessions.record_turn(session, user_message, llm_answer, token_count)
 
         await websocket.send_json({
             "message": interaction_info,
             "type": "answer"
         })
 
-    def retrieve_user_context(self):
+    async def retrieve_user_context(self):
         """
-        Retrieves the user stored context
+        Retrieves the user stored context.
+        The system message is built once per user name and shared by every session
         """
-        user_data = self.db_context.get_user_data()
+        user_data = await self.db_context.get_user_data()
         user_name = "Not provided"
         if user_data:
             name, model = user_data
             user_name = name
+
+        if self._system_prompt is not None and self._system_prompt_user == user_name:
+            return self._system_prompt
+
         user_context_message = {
             "role": "system",
             "content": f"""
@@ -129,5 +321,21 @@ class LLMService:
              4. If you include code in your answer, use triple backticks and indicate de language
                """
         }
+        self._system_prompt = user_context_message
+        self._system_prompt_user = user_name
 
         return user_context_message
+
+    async def retrieve_relevant_memories(self, user_prompt):
+        """
+        Returns a system message with the user memories related to the prompt,
+        or None when there are none
+        """
+        memories = await self.memory.relevant_memories(user_prompt)
+        if not memories:
+            return None
+        memory_lines = "\n".join(f"- {memory}" for memory in memories)
+        return {
+            "role": "system",
+            "content": f"Things you know about the user:\n{memory_lines}"
+        }
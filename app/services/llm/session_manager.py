@@ -0,0 +1,118 @@
+"""
+This module contains the in-memory conversation sessions used by the llm service.
+Every chat gets its own session so concurrent sockets never share history
+"""
+
+import asyncio
+from collections import OrderedDict
+
+
+class ChatTurn:
+    """
+    One user prompt and the llm answer for it, with the tokens both take
+    on the prompt so the context builder never recounts them
+    """
+    __slots__ = ("user_message", "model_message", "token_count")
+
+    def __init__(self, user_message: str, model_message: str, token_count: int):
+        self.user_message = user_message
+        self.model_message = model_message
+        self.token_count = token_count
+
+    def size(self) -> int:
+        """
+        Approximated memory footprint of the turn text
+        """
+        return len(self.user_message) + len(self.model_message)
+
+
+class ChatSession:
+    """
+    Holds the conversation state of a single chat.
+    The system prompt is not stored here, it is shared by all the sessions
+    and prepended when the ollama messages are built
+    """
+    __slots__ = ("chat_id", "turns", "size", "lock")
+
+    def __init__(self, chat_id: int, turns: list[ChatTurn] | None = None):
+        self.chat_id = chat_id
+        self.turns = turns if turns is not None else []
+        self.size = sum(turn.size() for turn in self.turns)
+        self.lock = asyncio.Lock()
+
+    def add_turn(self, user_message: str, model_message: str, token_count: int):
+        """
+        Appends a finished interaction to the session history
+        """
+        turn = ChatTurn(user_message, model_message, token_count)
+        self.turns.append(turn)
+        self.size += turn.size()
+
+
+class SessionManager:
+    """
+    Keeps the chat sessions keyed by chat_id with LRU eviction.
+    Sessions are dropped when there are more than max_sessions or when the
+    stored history goes over max_chars, evicted chats are reloaded from the
+    database the next time they are used
+    """
+
+    def __init__(self, max_sessions: int = 32, max_chars: int = 8_000_000):
+        self.max_sessions = max_sessions
+        self.max_chars = max_chars
+        self.total_chars = 0
+        self._sessions: OrderedDict[int, ChatSession] = OrderedDict()
+
+    def get(self, chat_id: int) -> ChatSession | None:
+        """
+        Returns the session for a chat and marks it as the most recently used
+        """
+        session = self._sessions.get(chat_id)
+        if session is not None:
+            self._sessions.move_to_end(chat_id)
+        return session
+
+    def put(self, session: ChatSession):
+        """
+        Registers a session under its chat_id
+        """
+        previous = self._sessions.pop(session.chat_id, None)
+        if previous is not None:
+            self.total_chars -= previous.size
+        self._sessions[session.chat_id] = session
+        self.total_chars += session.size
+        self._evict()
+
+    def record_turn(self, session: ChatSession, user_message: str,
+                    model_message: str, token_count: int):
+        """
+        Adds a turn to a session and keeps the memory accounting up to date
+        """
+        previous_size = session.size
+        session.add_turn(user_message, model_message, token_count)
+        if self._sessions.get(session.chat_id) is session:
+            self.total_chars += session.size - previous_size
+            self._sessions.move_to_end(session.chat_id)
+            self._evict()
+
+    def discard(self, chat_id: int):
+        """
+        Removes a session, used when a chat is deleted
+        """
+        session = self._sessions.pop(chat_id, None)
+        if session is not None:
+            self.total_chars -= session.size
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _evict(self):
+        """
+        Drops the least recently used sessions until both limits are satisfied.
+        The most recently used session is always kept
+        """
+        while len(self._sessions) > 1 and (
+                len(self._sessions) > self.max_sessions
+                or self.total_chars > self.max_chars):
+            _, session = self._sessions.popitem(last=False)
+            self.total_chars -= session.size
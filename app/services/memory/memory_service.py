@@ -0,0 +1,204 @@
+"""
+This module contains the user memory subsystem.
+Memories are embedded once, stored as float32 BLOBs and searched with a
+vectorized top-k so only the relevant ones reach the system prompt
+"""
+import asyncio
+import os
+import re
+import sqlite3
+from hashlib import blake2b
+import httpx
+import numpy as np
+from ollama import AsyncClient, ResponseError
+from app.db.async_repository import AsyncAureliusDB
+from app.exceptions.exception_handling import UnexpectedError
+
+LOCAL_EMBEDDING_DIM = 512
+LOCAL_EMBEDDING_MODEL = f"local-hash-{LOCAL_EMBEDDING_DIM}"
+WORD_PATTERN = re.compile(r"\w+")
+# Errors of an embedding request, Ollama may be starting or gone
+EMBEDDING_ERRORS = (ResponseError, ConnectionError, ValueError, httpx.HTTPError)
+
+
+def local_embeddings(texts: list[str]) -> np.ndarray:
+    """
+    Local stand-in used when Ollama has no embedding model.
+    Words and word pairs are hashed into a signed fixed size vector
+    (feature hashing), enough to match memories that share vocabulary
+    """
+    vectors = np.zeros((len(texts), LOCAL_EMBEDDING_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        words = WORD_PATTERN.findall(text.lower())
+        features = words + [f"{first} {second}"
+                            for first, second in zip(words, words[1:])]
+        for feature in features:
+            digest = int.from_bytes(
+                blake2b(feature.encode(), digest_size=8).digest(), "little")
+            sign = 1.0 if digest >> 63 == 0 else -1.0
+            vectors[row, digest % LOCAL_EMBEDDING_DIM] += sign
+    return vectors
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """
+    Scales every row to unit length in place so a dot product is the cosine similarity
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return vectors
+
+
+class MemoryService:
+    """
+    Keeps the user memories and their embeddings in a contiguous float32
+    matrix and retrieves the top-k memories relevant to a prompt.
+    The embedding model is chosen on first use: the Ollama model in
+    AURELIUS_EMBEDDING_MODEL when it is installed, otherwise the local stand-in.
+    While Ollama can not be reached nothing is chosen, the stored vectors
+    are kept and the next use tries again.
+    Memories embedded with another model are embedded again once and saved
+    """
+
+    def __init__(self, database: AsyncAureliusDB,
+                 ollama_client: AsyncClient | None = None,
+                 embedding_model: str | None = None,
+                 top_k: int = 5, min_score: float = 0.3):
+        self.database = database
+        self.ollama_client = ollama_client or AsyncClient()
+        self.ollama_model = embedding_model or os.getenv(
+            'AURELIUS_EMBEDDING_MODEL', 'nomic-embed-text')
+        self.top_k = top_k
+        self.min_score = min_score
+        self.embedding_model: str | None = None
+        self._texts: list[str] = []
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._count = 0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+    async def _embed(self, texts: list[str]) -> np.ndarray:
+        """
+        Embeds texts with the chosen model and returns normalized float32 rows
+        """
+        if self.embedding_model is None:
+            try:
+                vectors = await self._ollama_embeddings(texts)
+                self.embedding_model = f"ollama:{self.ollama_model}"
+                return vectors
+            except ResponseError as e:
+                if e.status_code != 404:
+                    raise
+                # Only a missing model picks the local stand-in, any other
+                # error would re-embed every stored memory with it
+                print(f"[Memory] {self.ollama_model} is not installed, "
+                      f"using local embeddings: {e}")
+                self.embedding_model = LOCAL_EMBEDDING_MODEL
+
+        if self.embedding_model == LOCAL_EMBEDDING_MODEL:
+            return normalize_rows(local_embeddings(texts))
+        return await self._ollama_embeddings(texts)
+
+    async def _ollama_embeddings(self, texts: list[str]) -> np.ndarray:
+        response = await self.ollama_client.embed(model=self.ollama_model, input=texts)
+        return normalize_rows(np.asarray(response.embeddings, dtype=np.float32))
+
+    async def _ensure_loaded(self):
+        """
+        Loads the stored memories once, embedding the ones that were saved
+        without an embedding of the current model
+        """
+        if self._loaded:
+            return
+        async with self._lock:
+            if self._loaded:
+                return
+            rows = await self.database.load_memory_vectors()
+            if not rows:
+                self._loaded = True
+                return
+            # Picks the embedding model before comparing it with the stored ones
+            await self._embed([rows[0][1]])
+
+            stale = [row for row in rows if row[2] is None
+                     or row[3] != self.embedding_model]
+            fresh_vectors = {}
+            if stale:
+                vectors = await self._embed([row[1] for row in stale])
+                fresh_vectors = {row[0]: vector for row, vector in zip(stale, vectors)}
+                await self.database.update_memory_embeddings(
+                    [(vector.tobytes(), self.embedding_model, memory_id)
+                     for memory_id, vector in fresh_vectors.items()])
+
+            dimension = len(next(iter(fresh_vectors.values()))) if fresh_vectors \
+                else len(rows[0][2]) // 4
+            self._vectors = np.empty((len(rows), dimension), dtype=np.float32)
+            for index, (memory_id, text, blob, _) in enumerate(rows):
+                vector = fresh_vectors.get(memory_id)
+                self._vectors[index] = vector if vector is not None \
+                    else np.frombuffer(blob, dtype=np.float32)
+                self._texts.append(text)
+            self._count = len(rows)
+            self._loaded = True
+
+    async def warm_up(self):
+        """
+        Loads the memory index before the first prompt needs it
+        """
+        await self._ensure_loaded()
+
+    def _append(self, text: str, vector: np.ndarray):
+        """
+        Adds a vector to the matrix, doubling its capacity when it is full
+        """
+        if self._count == 0 and self._vectors.shape[1] != len(vector):
+            self._vectors = np.empty((8, len(vector)), dtype=np.float32)
+            self._texts = []
+            self._count = 0
+        if self._count == len(self._vectors):
+            grown = np.empty((max(8, self._count * 2), len(vector)), dtype=np.float32)
+            grown[:self._count] = self._vectors[:self._count]
+            self._vectors = grown
+        self._vectors[self._count] = vector
+        self._texts.append(text)
+        self._count += 1
+
+    async def add_memory(self, text: str):
+        """
+        Embeds and saves a new memory
+        """
+        try:
+            await self._ensure_loaded()
+            vector = (await self._embed([text]))[0]
+        except EMBEDDING_ERRORS as e:
+            raise UnexpectedError(
+                f"An error occurred while embedding the memory {e}") from e
+        await self.database.save_memory(text, embedding=vector.tobytes(),
+                                        embedding_model=self.embedding_model)
+        self._append(text, vector)
+
+    async def relevant_memories(self, prompt: str) -> list[str]:
+        """
+        Returns the top-k memories most similar to the prompt, best first.
+        Memories are optional context, any failure returns none of them
+        """
+        try:
+            await self._ensure_loaded()
+        except (*EMBEDDING_ERRORS, sqlite3.Error) as e:
+            print(f"[Memory] Could not load the memories: {e}")
+            return []
+        if self._count == 0:
+            return []
+        try:
+            query = (await self._embed([prompt]))[0]
+        except EMBEDDING_ERRORS as e:
+            print(f"[Memory] Could not embed the prompt: {e}")
+            return []
+
+        scores = self._vectors[:self._count] @ query
+        k = min(self.top_k, self._count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self._texts[index] for index in top
+                if scores[index] >= self.min_score]
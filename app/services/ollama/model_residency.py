@@ -0,0 +1,110 @@
+"""
+This module contains the residency manager of the Ollama chat model.
+The user model is loaded before the first prompt needs it and kept in memory,
+the model it replaces is released right away
+"""
+import asyncio
+import os
+import httpx
+from ollama import AsyncClient, ResponseError
+from app.services.llm.context_builder import ContextBuilder
+from app.services.ollama.ollama_status import OllamaStatus
+
+DEFAULT_KEEP_ALIVE = "30m"
+
+
+class ModelResidency:
+    """
+    Keeps the active chat model resident on Ollama.
+    Preloads use the same num_ctx as the chat requests, otherwise Ollama
+    loads the model again on the first prompt with the new context size.
+    Every request keeps it alive for keep_alive (AURELIUS_KEEP_ALIVE, an
+    Ollama duration like "30m" or -1 for ever) and the previous active model
+    is unloaded with keep_alive 0 when the user switches models
+    """
+
+    def __init__(self, ollama_client: AsyncClient, ollama_status: OllamaStatus,
+                 context_builder: ContextBuilder, keep_alive: str | None = None):
+        self.ollama_client = ollama_client
+        self.ollama_status = ollama_status
+        self.context_builder = context_builder
+        keep_alive = keep_alive or os.getenv('AURELIUS_KEEP_ALIVE', DEFAULT_KEEP_ALIVE)
+        self.keep_alive: str | int = int(keep_alive) \
+            if keep_alive.lstrip("-").isdigit() else keep_alive
+        self.active_model: str | None = None
+        self._preloads: dict[str, asyncio.Task] = {}
+        self._background: set[asyncio.Task] = set()
+
+    async def activate(self, model: str):
+        """
+        Makes a model the active one and waits until it is loaded.
+        Concurrent calls for the same model share one preload
+        """
+        self.use(model)
+        task = self._preloads.get(model)
+        if task is None or task.done():
+            task = asyncio.create_task(self._preload(model))
+            self._preloads[model] = task
+        await asyncio.shield(task)
+
+    def activate_in_background(self, model: str):
+        """
+        Preloads a model without waiting for it, used when the user changes it
+        """
+        self._spawn(self._activate_quietly(model))
+
+    def use(self, model: str):
+        """
+        Marks the model of a request as the active one,
+        releasing the previous active model on the background
+        """
+        previous, self.active_model = self.active_model, model
+        if previous is not None and previous != model:
+            self._spawn(self._unload(previous))
+
+    async def _activate_quietly(self, model: str):
+        try:
+            await self.activate(model)
+        except (ResponseError, httpx.HTTPError, ConnectionError) as e:
+            print(f"[Ollama] Could not preload {model}: {e}")
+
+    async def _preload(self, model: str):
+        """
+        A generate request without prompt only loads the model
+        """
+        if not await self.ollama_status.is_available():
+            raise ConnectionError("Ollama is not running")
+        await self.ollama_client.generate(
+            model=model, keep_alive=self.keep_alive,
+            options={"num_ctx": self.context_builder.context_tokens(model)})
+        print(f"[Ollama] {model} loaded")
+
+    async def _unload(self, model: str):
+        if model == self.active_model:
+            # The user switched back before the release ran
+            return
+        preload = self._preloads.pop(model, None)
+        if preload is not None and not preload.done():
+            preload.cancel()
+        try:
+            await self.ollama_client.generate(model=model, keep_alive=0)
+            print(f"[Ollama] {model} released")
+        except (ResponseError, httpx.HTTPError, ConnectionError) as e:
+            print(f"[Ollama] Could not release {model}: {e}")
+
+    def _spawn(self, coroutine):
+        # Keeps a reference so the task is not garbage collected mid-flight
+        task = asyncio.create_task(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def stop(self):
+        """
+        Cancels the preloads and releases still running.
+        The active model stays loaded for keep_alive, Ollama frees it after
+        """
+        tasks = list(self._background) + [
+            task for task in self._preloads.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,111 @@
+"""
+This module contains a cache of the Ollama server status and installed models.
+A background task keeps it fresh so the http endpoints answer from memory
+"""
+import asyncio
+import time
+import httpx
+from ollama import ListResponse
+
+
+class OllamaStatus:
+    """
+    Caches if Ollama is reachable and the models it has installed.
+    The cache is refreshed every refresh_interval seconds by a background task,
+    and on demand when it is older than ttl. While Ollama is known to be down
+    callers get the cached answer right away instead of waiting for a timeout
+    """
+
+    def __init__(self, host: str = "http://localhost:11434",
+                 ttl: float = 15.0, refresh_interval: float = 5.0,
+                 timeout: float = 2.0):
+        self.host = host
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.available = False
+        self.models: list[dict] = []
+        self.checked_at = 0.0
+        self._client: httpx.AsyncClient | None = None
+        self._refresh_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(base_url=self.host,
+                                             timeout=self.timeout)
+        return self._client
+
+    async def refresh(self):
+        """
+        Checks Ollama with a single /api/tags request, which also
+        returns the installed models
+        """
+        async with self._refresh_lock:
+            await self._probe()
+
+    async def _probe(self):
+        try:
+            response = await self._get_client().get("/api/tags")
+            if response.status_code == 200:
+                model_list = ListResponse(**response.json())
+                self.models = [dict(model) for model in model_list.models]
+                self.available = True
+            else:
+                self.available = False
+        except (httpx.HTTPError, OSError, ValueError):
+            self.available = False
+        self.checked_at = time.monotonic()
+
+    def _is_stale(self) -> bool:
+        return time.monotonic() - self.checked_at > self.ttl
+
+    async def _refresh_if_stale(self):
+        """
+        Refreshes an expired cache once, concurrent callers wait for that probe
+        """
+        if not self._is_stale():
+            return
+        async with self._refresh_lock:
+            if self._is_stale():
+                await self._probe()
+
+    async def is_available(self) -> bool:
+        """
+        Returns if the Ollama server is running and accessible
+        """
+        await self._refresh_if_stale()
+        return self.available
+
+    async def get_models(self) -> list[dict]:
+        """
+        Returns the installed Ollama models, empty while Ollama is down
+        """
+        await self._refresh_if_stale()
+        return self.models if self.available else []
+
+    def start(self):
+        """
+        Starts the background refresh loop
+        """
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    async def stop(self):
+        """
+        Stops the background refresh and closes the http client
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
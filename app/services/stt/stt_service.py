@@ -0,0 +1,149 @@
+"""
+This module contains the speech to text service.
+faster-whisper runs on a separate process so the CPU bound decoding never
+blocks the event loop nor competes for its GIL
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from app.exceptions.exception_handling import TranscriptionException
+from app.utils.wav_converter.wav_converter import to_whisper_audio
+
+STT_SAMPLE_RATE = 16000
+
+# Model of the worker process, loaded by the pool initializer
+_worker_model = None
+
+
+def _load_worker_model(model_size: str, compute_type: str, download_root: str | None):
+    global _worker_model
+    from faster_whisper import WhisperModel
+    _worker_model = WhisperModel(model_size, device="cpu",
+                                 compute_type=compute_type,
+                                 download_root=download_root)
+
+
+def _worker_ready() -> bool:
+    return _worker_model is not None
+
+
+def _transcribe_in_worker(pcm: bytes, language: str | None) -> str:
+    """
+    Transcribes 16 kHz mono int16 PCM on the worker process
+    """
+    audio = to_whisper_audio(pcm)
+    segments, _ = _worker_model.transcribe(audio, language=language,
+                                           beam_size=1,
+                                           condition_on_previous_text=False)
+    return " ".join(segment.text.strip() for segment in segments).strip()
+
+
+class STTService:
+    """
+    Transcribes utterances with faster-whisper on a process pool.
+    The pool and the model load the first time a transcription is requested.
+    A pool broken by a dead worker is discarded and on_pool_lost is called,
+    the next transcription starts a new one.
+    Partial transcripts never take the last free worker, a final one must
+    not wait behind them, so with a single worker there are none
+    """
+
+    def __init__(self, model_size: str | None = None, workers: int | None = None,
+                 compute_type: str = "int8", language: str | None = None,
+                 on_pool_lost=None):
+        self.model_size = model_size or os.getenv('AURELIUS_STT_MODEL', 'base')
+        self.workers = workers or int(os.getenv('AURELIUS_STT_WORKERS', '1'))
+        self.compute_type = compute_type
+        self.language = language or os.getenv('AURELIUS_STT_LANGUAGE') or None
+        self.download_root = os.getenv('AURELIUS_STT_MODELS_DIR') or None
+        self.sample_rate = STT_SAMPLE_RATE
+        self.on_pool_lost = on_pool_lost
+        self._executor: ProcessPoolExecutor | None = None
+        self._partials_running = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_load_worker_model,
+                initargs=(self.model_size, self.compute_type, self.download_root))
+        return self._executor
+
+    async def transcribe(self, pcm: bytes) -> str:
+        """
+        Transcribes an utterance of 16 kHz mono int16 PCM
+        """
+        executor = self._get_executor()
+        try:
+            return await asyncio.wrap_future(
+                executor.submit(_transcribe_in_worker, pcm, self.language))
+        except Exception as e:
+            raise self._transcription_error(executor, e) from e
+
+    async def transcribe_partial(self, pcm: bytes) -> str | None:
+        """
+        Transcribes the speech so far while the user keeps talking.
+        Returns None when no worker can be spared for it
+        """
+        if self._partials_running >= self.workers - 1:
+            return None
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_transcribe_in_worker, pcm, self.language)
+        except Exception as e:
+            raise self._transcription_error(executor, e) from e
+        # Counted until the worker really finishes, cancelling the caller
+        # does not stop a decode that already started
+        self._partials_running += 1
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(partial(self._partial_finished, loop))
+        try:
+            return await asyncio.wrap_future(future)
+        except Exception as e:
+            raise self._transcription_error(executor, e) from e
+
+    def _partial_finished(self, loop: asyncio.AbstractEventLoop, _future):
+        def release():
+            self._partials_running -= 1
+        try:
+            loop.call_soon_threadsafe(release)
+        except RuntimeError:
+            # The loop is closed, the service is shutting down
+            pass
+
+    def _transcription_error(self, executor: ProcessPoolExecutor,
+                             error: Exception) -> TranscriptionException:
+        if isinstance(error, BrokenProcessPool) and self._executor is executor:
+            # A worker died, like killed for memory. Other calls may have
+            # replaced the pool already
+            self.close()
+            if self.on_pool_lost is not None:
+                self.on_pool_lost()
+        return TranscriptionException(f"Error transcribing audio: {error}")
+
+    async def warm_up(self):
+        """
+        Starts the worker processes and waits until they loaded the model.
+        A pool whose model failed to load is discarded so the next use retries
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            await asyncio.gather(*[
+                loop.run_in_executor(executor, _worker_ready)
+                for _ in range(self.workers)])
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        """
+        Stops the worker processes
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,81 @@
+"""
+This module cuts a live microphone stream into utterances
+"""
+from app.utils.ring_buffer.ring_buffer import PCMRingBuffer
+from app.utils.vad.vad import VoiceActivityDetector
+
+
+class UtteranceSegmenter:
+    """
+    Buffers the speech of the current utterance and tells when it ended.
+    Utterances start and end with the voice activity detector events,
+    and are cut when they reach max_seconds
+    """
+
+    def __init__(self, vad: VoiceActivityDetector, sample_rate: int = 16000,
+                 max_seconds: int = 30, partial_ms: int = 1000,
+                 partial_tail_seconds: int = 5):
+        self.vad = vad
+        self.partial_bytes = partial_ms * sample_rate * 2 // 1000
+        self.partial_tail_bytes = partial_tail_seconds * sample_rate * 2
+        self.buffer = PCMRingBuffer(max_seconds * sample_rate * 2)
+        self.in_speech = False
+        self._bytes_since_partial = 0
+
+    def push(self, chunk: bytes) -> list[bytes]:
+        """
+        Adds a chunk of 16 bit mono PCM.
+        Returns the utterances this chunk completed, usually none or one
+        """
+        utterances = []
+        for event, audio in self.vad.process(chunk):
+            if event == "start":
+                self.in_speech = True
+                self.buffer.clear()
+                self._write(audio, utterances)
+            elif event == "speech":
+                self._write(audio, utterances)
+            elif self.in_speech:
+                utterances.append(self._finish())
+        return utterances
+
+    def _write(self, audio: bytes, utterances: list[bytes]):
+        if len(self.buffer) + len(audio) > self.buffer.capacity:
+            # Too long to wait for a pause, the utterance is cut here
+            utterances.append(self._finish())
+            self.in_speech = True
+        self.buffer.write(audio)
+        self._bytes_since_partial += len(audio)
+
+    def partial_ready(self) -> bool:
+        """
+        Tells if enough new speech arrived for a partial transcript.
+        Not during a pause, the utterance may be about to end and its final
+        transcription would wait behind the partial one
+        """
+        return self.in_speech and self._bytes_since_partial >= self.partial_bytes \
+            and not self.vad.in_hangover()
+
+    def current(self) -> bytes:
+        """
+        Returns the last seconds of the utterance so far, for a partial
+        transcript, so its cost does not grow with the utterance
+        """
+        self._bytes_since_partial = 0
+        return self.buffer.read(last=self.partial_tail_bytes)
+
+    def flush(self) -> bytes | None:
+        """
+        Ends the current utterance right away, if there is one
+        """
+        self.vad.reset()
+        if not self.in_speech:
+            return None
+        return self._finish()
+
+    def _finish(self) -> bytes:
+        utterance = self.buffer.read()
+        self.buffer.clear()
+        self.in_speech = False
+        self._bytes_since_partial = 0
+        return utterance
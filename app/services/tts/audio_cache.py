@@ -0,0 +1,158 @@
+"""
+This module contains the disk cache of synthesized speech.
+Assistants repeat many sentences ("Sure.", greetings, error messages), their
+audio is stored once by content and played again without touching Kokoro
+"""
+import hashlib
+import mmap
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from app.db.init_db import get_app_data_dir
+
+# Bump it when the stored audio changes (model, encoding) to ignore old entries
+CACHE_FORMAT = 1
+DEFAULT_CACHE_MB = 64
+
+
+def default_cache_dir() -> Path:
+    """
+    Cache directory, next to the database unless AURELIUS_TTS_CACHE_DIR is set
+    """
+    env_cache_dir = os.getenv('AURELIUS_TTS_CACHE_DIR')
+    if env_cache_dir:
+        return Path(env_cache_dir)
+    env_db_path = os.getenv('DATABASE_PATH')
+    if env_db_path:
+        return Path(env_db_path).parent / "tts_cache"
+    return get_app_data_dir() / "tts_cache"
+
+
+def normalize_sentence(text: str) -> str:
+    """
+    Normalizes the text so the same sentence always gets the same key.
+    The case is kept because it can change the pronunciation ("US" and "us")
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class AudioCache:
+    """
+    Content addressed WAV files with a total size budget.
+    The key is a hash of the normalized sentence, the voice and the speed.
+    Least recently used files are deleted when the budget is exceeded,
+    hits are memory mapped instead of read into a new buffer
+    """
+
+    def __init__(self, directory: Path | None = None, max_bytes: int | None = None):
+        self.directory = Path(directory or default_cache_dir())
+        if max_bytes is None:
+            max_bytes = int(os.getenv('AURELIUS_TTS_CACHE_MB',
+                                      str(DEFAULT_CACHE_MB))) * 1024 * 1024
+        self.max_bytes = max_bytes
+        self.size = 0
+        # key -> file size, least recently used first
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+        if self.enabled():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._load_index()
+
+    def enabled(self) -> bool:
+        """AURELIUS_TTS_CACHE_MB=0 disables the cache"""
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(text: str, voice: str, speed: float, lang_code: str) -> str:
+        """Returns the content key of a sentence"""
+        content = "\0".join([str(CACHE_FORMAT), lang_code, voice,
+                             f"{speed:.3f}", normalize_sentence(text)])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.wav"
+
+    def _load_index(self):
+        """
+        Rebuilds the LRU order from the files left by previous runs,
+        their modification time is refreshed on every hit
+        """
+        for temporary in self.directory.glob("*.tmp"):
+            temporary.unlink(missing_ok=True)
+        files = []
+        for path in self.directory.glob("*.wav"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self.size += size
+        self._evict()
+
+    def contains(self, key: str) -> bool:
+        """
+        Tells if a key is on the index, without touching the disk
+        """
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: str) -> memoryview | None:
+        """
+        Returns the cached WAV as a read only view of the mapped file.
+        It opens the file, call it off the event loop
+        """
+        if not self.enabled():
+            return None
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            os.utime(path)
+        except (OSError, ValueError):
+            # Deleted from outside or empty, forget it
+            with self._lock:
+                self.size -= self._entries.pop(key, 0)
+            return None
+        # The map is closed when the last view of it is released
+        return memoryview(mapped)
+
+    def put(self, key: str, wav) -> None:
+        """
+        Stores a WAV, the file is written aside and renamed so readers
+        never see half of it. It runs on the TTS worker threads
+        """
+        if not self.enabled() or len(wav) > self.max_bytes:
+            return
+        path = self._path(key)
+        temporary = path.with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            with open(temporary, "wb") as file:
+                file.write(wav)
+            os.replace(temporary, path)
+        except OSError as e:
+            print(f"[TTS] Could not cache audio: {e}")
+            temporary.unlink(missing_ok=True)
+            return
+        with self._lock:
+            self.size += len(wav) - self._entries.pop(key, 0)
+            self._entries[key] = len(wav)
+            self._evict()
+
+    def _evict(self):
+        """Deletes the least recently used files until the cache fits"""
+        while self.size > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self.size -= size
+            try:
+                self._path(key).unlink(missing_ok=True)
+            except OSError:
+                # Still mapped by a reader on Windows, the next run removes it
+                pass
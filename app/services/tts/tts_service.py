@@ -0,0 +1,119 @@
+"""
+This module contains the text to speech service used by the voice mode.
+Kokoro runs on a small pool of worker threads so sentences are synthesized
+while the llm keeps generating the rest of the answer
+"""
+import asyncio
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from app.exceptions.exception_handling import TTSException
+from app.services.tts.audio_cache import AudioCache
+from app.utils.wav_converter.wav_converter import WavConverter
+
+KOKORO_SAMPLE_RATE = 24000
+MARKDOWN_SYMBOLS = re.compile(r"[*_#>`~|]+")
+LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+
+
+def clean_for_speech(text: str) -> str:
+    """
+    Removes the markdown that should not be read aloud
+    """
+    text = LINK.sub(r"\1", text)
+    text = MARKDOWN_SYMBOLS.sub(" ", text)
+    return " ".join(text.split())
+
+
+class TTSService:
+    """
+    Synthesizes sentences with Kokoro on a pool of worker threads.
+    Every worker loads its own pipeline the first time it is used.
+    Synthesized sentences are kept on the audio cache and played from it
+    the next time without using a worker, the hits are read on a cache
+    thread so the disk never blocks the event loop
+    """
+
+    def __init__(self, workers: int | None = None, lang_code: str = "a",
+                 voice: str | None = None, speed: float = 1.0,
+                 cache: AudioCache | None = None):
+        self.workers = workers or int(os.getenv('AURELIUS_TTS_WORKERS', '1'))
+        self.lang_code = lang_code
+        self.voice = voice or os.getenv('AURELIUS_TTS_VOICE', 'af_heart')
+        self.speed = speed
+        self.sample_rate = KOKORO_SAMPLE_RATE
+        self.cache = cache if cache is not None else AudioCache()
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="aurelius-tts")
+        self._cache_reader = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="aurelius-tts-cache")
+
+    def _get_pipeline(self):
+        pipeline = getattr(self._local, "pipeline", None)
+        if pipeline is None:
+            from kokoro import KPipeline
+            pipeline = KPipeline(lang_code=self.lang_code)
+            self._local.pipeline = pipeline
+        return pipeline
+
+    def synthesize(self, text: str, voice: str | None = None,
+                   speed: float | None = None) -> bytearray:
+        """
+        Synthesizes a sentence and returns it as 16 bit PCM WAV bytes.
+        It blocks, use synthesize_async from the event loop
+        """
+        try:
+            pipeline = self._get_pipeline()
+            chunks = [np.asarray(result.audio, dtype=np.float32)
+                      for result in pipeline(text, voice=voice or self.voice,
+                                             speed=speed or self.speed)
+                      if result.audio is not None]
+        except Exception as e:
+            raise TTSException(f"Error synthesizing speech: {e}") from e
+
+        audio = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+        return WavConverter.float_to_wav(audio, self.sample_rate)
+
+    def _synthesize_and_cache(self, key: str, text: str, voice: str,
+                              speed: float) -> bytearray:
+        audio = self.synthesize(text, voice, speed)
+        self.cache.put(key, audio)
+        return audio
+
+    async def synthesize_async(self, text: str, voice: str | None = None,
+                               speed: float | None = None) -> bytearray | memoryview:
+        """
+        Returns the cached audio of the sentence or queues it on the TTS workers
+        """
+        voice = voice or self.voice
+        speed = speed or self.speed
+        key = AudioCache.make_key(text, voice, speed, self.lang_code)
+        loop = asyncio.get_running_loop()
+        if self.cache.contains(key):
+            # Misses never leave the loop, only the hits open their file
+            cached = await loop.run_in_executor(self._cache_reader,
+                                                self.cache.get, key)
+            if cached is not None:
+                return cached
+
+        return await loop.run_in_executor(
+            self._executor, self._synthesize_and_cache, key, text, voice, speed)
+
+    async def warm_up(self):
+        """
+        Loads the Kokoro pipeline on the workers before the first sentence
+        """
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(self._executor, self._get_pipeline)
+            for _ in range(self.workers)])
+
+    def close(self):
+        """
+        Stops the TTS workers and the cache thread
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._cache_reader.shutdown(wait=False, cancel_futures=True)
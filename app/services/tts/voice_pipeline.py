@@ -0,0 +1,105 @@
+"""
+This module contains the sentence pipeline of the voice mode.
+The answer is split into sentences while it streams, every sentence is
+synthesized as soon as it is complete and the audio is sent in order
+"""
+import asyncio
+import re
+from app.exceptions.exception_handling import TTSException, socket_exeption_handling
+from app.services.tts.tts_service import TTSService, clean_for_speech
+from app.utils.socket_channel.socket_channel import SocketChannel
+
+
+class VoicePipeline:
+    """
+    Overlaps the llm generation with the speech synthesis.
+    feed receives the answer deltas, complete sentences go straight to the
+    TTS workers and a sender task streams the audio back in sentence order,
+    each one as an 'audio' frame followed by a binary frame with the WAV bytes
+    """
+
+    def __init__(self, tts: TTSService, websocket: SocketChannel,
+                 sentence_separator: re.Pattern):
+        self.tts = tts
+        self.websocket = websocket
+        self.sentence_separator = sentence_separator
+        self._buffer = ""
+        self._in_code_block = False
+        self._sequence = 0
+        self._pending: asyncio.Queue = asyncio.Queue()
+        self._sender = asyncio.create_task(self._send_in_order())
+
+    def feed(self, delta: str):
+        """
+        Adds an answer delta and queues every sentence it completes
+        """
+        self._buffer += delta
+        sentences = self.sentence_separator.split(self._buffer)
+        self._buffer = sentences.pop()
+        for sentence in sentences:
+            self._submit(sentence)
+
+    def _submit(self, sentence: str):
+        """
+        Starts the synthesis of a sentence, code blocks are never read aloud
+        """
+        segments = sentence.split("```")
+        spoken = []
+        for index, segment in enumerate(segments):
+            if not self._in_code_block:
+                spoken.append(segment)
+            if index < len(segments) - 1:
+                self._in_code_block = not self._in_code_block
+
+        text = clean_for_speech(" ".join(spoken))
+        if not text:
+            return
+        synthesis = asyncio.ensure_future(self.tts.synthesize_async(text))
+        self._pending.put_nowait((self._sequence, text, synthesis))
+        self._sequence += 1
+
+    async def _send_in_order(self):
+        while True:
+            item = await self._pending.get()
+            if item is None:
+                return
+            sequence, text, synthesis = item
+            try:
+                audio = await synthesis
+            except TTSException as e:
+                await socket_exeption_handling(
+                    ws=self.websocket, error_type="error",
+                    message="An error occured on TTS Service",
+                    details=str(e.detail))
+                continue
+
+            await self.websocket.send_json({
+                "message": {
+                    "seq": sequence,
+                    "text": text,
+                    "sample_rate": self.tts.sample_rate,
+                    "format": "wav"
+                },
+                "type": "audio"
+            })
+            await self.websocket.send_bytes(audio)
+
+    async def finish(self):
+        """
+        Queues the last sentence and waits until all the audio was sent
+        """
+        if self._buffer.strip():
+            self._submit(self._buffer)
+        self._buffer = ""
+        self._pending.put_nowait(None)
+        await self._sender
+
+    def cancel(self):
+        """
+        Drops the sentences not synthesized yet, used when the generation fails
+        """
+        self._sender.cancel()
+        while not self._pending.empty():
+            item = self._pending.get_nowait()
+            if item is not None:
+                item[2].cancel()
@@ -1,11 +1,14 @@
 """
 This module contains a class to satisfy user requirements
 """
-import httpx
-import ollama
+from fastapi import Depends
 from app.exceptions.exception_handling import UnexpectedError, NotFoundException
-from app.db.init_db import AureliusDB
+from app.db.async_repository import AsyncAureliusDB
 from app.schemas.schemas import UserSetup
+from app.services.ollama.ollama_status import OllamaStatus
+from app.services.ollama.model_residency import ModelResidency
+from app.utils.model_loading.model_loading import (
+    get_database, get_ollama_status, get_model_residency)
 
 
 class UserService:
@@ -14,51 +17,44 @@ class UserService:
     Alongside with methods to verify ollama installation and available models
     """
 
-    def __init__(self):
-        self.database = AureliusDB()
+    def __init__(self, database: AsyncAureliusDB = Depends(get_database),
+                 ollama_status: OllamaStatus = Depends(get_ollama_status),
+                 residency: ModelResidency = Depends(get_model_residency)):
+        self.database = database
+        self.ollama_status = ollama_status
+        self.residency = residency
 
-    def is_ollama_installed(self):
+    async def is_ollama_installed(self):
         """
-        This method verifies if ollama server is running and accessible
+        This method verifies if ollama server is running and accessible.
+        It answers from the status cache, refreshed on the background
         """
-        try:
-            response = httpx.get('http://localhost:11434/api/tags', timeout=5)
-            return response.status_code == 200
-        except httpx.ConnectError:
-            return False
-        except httpx.TimeoutException:
-            return False
-        except OSError:
-            return False
+        return await self.ollama_status.is_available()
 
-    def retrieve_ollama_models_list(self):
+    async def retrieve_ollama_models_list(self):
         """
         This method retrieves the available local models from ollama
 
         :param self: Description
         """
         try:
-            model_list = ollama.list()
-            available_models = []
-            for model in model_list.get('models', []):
-                available_models.append(dict(model))
-            return available_models
+            return await self.ollama_status.get_models()
         except Exception as e:
             raise UnexpectedError(
                 f"An error occurred while retrieving ollama models {e}") from e
 
-    def is_user_regitered(self):
+    async def is_user_regitered(self):
         """
         This method verifies is user is already registered
 
         :param self: Description
         """
-        user_name = self.database.is_user_registerd()
+        user_name = await self.database.is_user_registerd()
         if user_name is None:
             return False
         return True
 
-    def register_user(self, user: UserSetup):
+    async def register_user(self, user: UserSetup):
         """
         This method creates the user for the local database
 
@@ -67,12 +63,13 @@ class UserService:
         :type user: UserSetup
         """
         try:
-            self.database.register_user(user.user_name, user.model)
+            await self.database.register_user(user.user_name, user.model)
         except Exception as e:
             raise UnexpectedError(
                 f"An error occurred while user registration {e}") from e
+        self.residency.activate_in_background(user.model)
 
-    def update_user_info(self, user: UserSetup):
+    async def update_user_info(self, user: UserSetup):
         """
         This method updates user local database info
 
@@ -81,18 +78,21 @@ class UserService:
         :type user: UserSetup
         """
         try:
-            self.database.update_user_data(user.user_name, user.model)
+            await self.database.update_user_data(user.user_name, user.model)
         except Exception as e:
             raise UnexpectedError(
                 f"An error occurred while updating data {e}") from e
+        # The new model loads while the user goes back to the chat
+        if user.model != self.residency.active_model:
+            self.residency.activate_in_background(user.model)
 
-    def get_user_data(self):
+    async def get_user_data(self):
         """
         This method gets local user data
         """
 
-        if not self.is_user_regitered():
+        if not await self.is_user_regitered():
             raise NotFoundException("User not found")
 
-        data = self.database.get_user_data()
+        data = await self.database.get_user_data()
         return data
@@ -1,6 +1,6 @@
 """
-This module initializes on the background
- all the required dependencies before app startup
+This module initializes the required dependencies on app startup.
+The heavy models load on the background through the model registry
 """
 
 from contextlib import asynccontextmanager
@@ -11,21 +11,115 @@ aurelius_models = {}
 database_instances = {}
 
 
+def get_database():
+    """
+    Dependency that returns the async application database access.
+    It is backed by the connection pool created on lifespan
+    """
+    return database_instances["db"]
+
+
+def get_memory_service():
+    """
+    Dependency that returns the user memory service
+    """
+    return aurelius_models["memory"]
+
+
+def get_ollama_status():
+    """
+    Dependency that returns the cached Ollama status
+    """
+    return aurelius_models["ollama"]
+
+
+def get_model_residency():
+    """
+    Dependency that returns the residency manager of the Ollama chat model
+    """
+    return aurelius_models["llm"].residency
+
+
+def get_model_registry():
+    """
+    Dependency that returns the registry with the load state of the models
+    """
+    return aurelius_models["registry"]
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
 
     # Import only when lifespan actually runs (after freeze_support)
+    print("Starting database initialization...")
+
+    from app.db.connection_pool import ConnectionPool
+    from app.db.init_db import AureliusDB, get_database_path
+    from app.db.async_repository import AsyncAureliusDB
+
+    pool = ConnectionPool(get_database_path())
+    database = AureliusDB(pool=pool)
+    # Schema checks run only once per process
+    database.create_tables()
+    async_database = AsyncAureliusDB(database)
+    await async_database.start()
+    database_instances["pool"] = pool
+    database_instances["db"] = async_database
+
     print("Starting model initialization...")
 
+    from app.services.ollama.ollama_status import OllamaStatus
+
+    ollama_status = OllamaStatus()
+    ollama_status.start()
+    aurelius_models["ollama"] = ollama_status
+
+    from app.services.memory.memory_service import MemoryService
+    from app.services.tts.tts_service import TTSService
+    from app.services.stt.stt_service import STTService
     from app.services.llm.llm_service import LLMService
+    from app.utils.model_loading.model_registry import ModelRegistry
 
-    llm_service = LLMService()
+    # The services are cheap to build, their models load on the registry
+    model_registry = ModelRegistry()
+
+    memory_service = MemoryService(async_database)
+    aurelius_models["memory"] = memory_service
+
+    tts_service = TTSService()
+    aurelius_models["tts"] = tts_service
+
+    stt_service = STTService(
+        on_pool_lost=lambda: model_registry.invalidate("stt"))
+    aurelius_models["stt"] = stt_service
+
+    llm_service = LLMService(async_database, ollama_status, memory_service,
+                             tts=tts_service)
     aurelius_models["llm"] = llm_service
 
+    # The user model, Kokoro, faster-whisper and the memory index load in
+    # parallel while the server already answers, text chat never waits for
+    # the audio models
+    model_registry.register("llm", llm_service.warm_up)
+    model_registry.register("memory", memory_service.warm_up)
+    model_registry.register("tts", tts_service.warm_up)
+    model_registry.register("stt", stt_service.warm_up)
+    model_registry.start()
+    aurelius_models["registry"] = model_registry
+
     _initialized = True
-    print("Model initialization complete.")
+    print("Server ready, models loading in the background.")
 
     yield
     print("Shutting down models...")
+    await model_registry.stop()
+    llm_service.cancel_prefetch()
+    await llm_service.residency.stop()
+    await ollama_status.stop()
+    tts_service.close()
+    stt_service.close()
     aurelius_models.clear()
+    database_instances.clear()
+    await async_database.close()
+    pool.close()
     _initialized = False
@@ -0,0 +1,168 @@
+"""
+This module contains the registry of the models loaded in the background.
+The server starts accepting connections right away, every model loads on its
+own task and the features that need one wait only for that one
+"""
+import asyncio
+import os
+import time
+from app.exceptions.exception_handling import ModelNotReadyException
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class ModelState:
+    """
+    Load state of a registered model
+    """
+    __slots__ = ("name", "loader", "preload", "status", "error",
+                 "started_at", "load_seconds", "task")
+
+    def __init__(self, name: str, loader, preload: bool):
+        self.name = name
+        self.loader = loader
+        self.preload = preload
+        self.status = PENDING
+        self.error: str | None = None
+        self.started_at: float | None = None
+        self.load_seconds: float | None = None
+        self.task: asyncio.Task | None = None
+
+    def as_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "preload": self.preload,
+            "load_seconds": None if self.load_seconds is None
+            else round(self.load_seconds, 3),
+            "error": self.error
+        }
+
+
+def parse_preload(value: str | None, names: list[str]) -> set[str]:
+    """
+    Parses AURELIUS_PRELOAD: "all" (default), "none" or a list like "tts,stt"
+    """
+    if value is None or value.strip().lower() == "all":
+        return set(names)
+    if value.strip().lower() == "none":
+        return set()
+    return {name.strip() for name in value.split(",") if name.strip()}
+
+
+class ModelRegistry:
+    """
+    Loads the registered models on background tasks, all of them in parallel.
+    A loader is an async function that leaves the model ready to use.
+    Models that are not preloaded, or that failed, load the first time
+    a feature calls ensure
+    """
+
+    def __init__(self):
+        self._models: dict[str, ModelState] = {}
+
+    def register(self, name: str, loader, preload: bool = True):
+        """
+        Adds a model, it is not loaded until start or ensure
+        """
+        self._models[name] = ModelState(name, loader, preload)
+
+    def start(self):
+        """
+        Starts loading the preloaded models, the ones in AURELIUS_PRELOAD
+        """
+        selected = parse_preload(os.getenv('AURELIUS_PRELOAD'), list(self._models))
+        for state in self._models.values():
+            state.preload = state.preload and state.name in selected
+            if state.preload:
+                self._load(state)
+
+    def _load(self, state: ModelState) -> asyncio.Task:
+        """
+        Starts the load of a model unless it is loading already
+        """
+        if state.task is None or state.task.done():
+            state.status = LOADING
+            state.error = None
+            state.started_at = time.perf_counter()
+            state.task = asyncio.create_task(self._run_loader(state))
+        return state.task
+
+    async def _run_loader(self, state: ModelState):
+        try:
+            await state.loader()
+        except asyncio.CancelledError:
+            state.status = PENDING
+            raise
+        except Exception as e:
+            state.status = FAILED
+            state.error = str(e)
+            print(f"[Models] {state.name} failed to load: {e}")
+        else:
+            state.status = READY
+            print(f"[Models] {state.name} ready")
+        finally:
+            state.load_seconds = time.perf_counter() - state.started_at
+
+    def request(self, name: str):
+        """
+        Starts loading a model on first use without waiting for it
+        """
+        state = self._models[name]
+        if state.status in (PENDING, FAILED):
+            self._load(state)
+
+    async def ensure(self, name: str):
+        """
+        Waits until a model is ready, loading it on first use.
+        Failed models are loaded again, a new failure raises ModelNotReadyException
+        """
+        state = self._models[name]
+        if state.status == READY:
+            return
+        if state.status != LOADING:
+            self._load(state)
+        # shield: a client leaving does not cancel a load other clients wait for
+        await asyncio.shield(state.task)
+        if state.status != READY:
+            raise ModelNotReadyException(name, state.error or "Model not loaded")
+
+    def invalidate(self, name: str):
+        """
+        Marks a ready model as not loaded, like after its worker died.
+        Preloaded models load again right away, the rest on their next use
+        """
+        state = self._models[name]
+        if state.status == READY:
+            state.status = PENDING
+            print(f"[Models] {name} lost, it will load again")
+            if state.preload:
+                self._load(state)
+
+    def is_ready(self, name: str) -> bool:
+        """Tells if a model finished loading"""
+        return self._models[name].status == READY
+
+    def ready(self) -> bool:
+        """
+        True once no preloaded model is still loading,
+        failed models are reported but do not keep the app waiting
+        """
+        return all(state.status in (READY, FAILED)
+                   for state in self._models.values() if state.preload)
+
+    def snapshot(self) -> dict[str, dict]:
+        """Returns the state of every model"""
+        return {name: state.as_dict() for name, state in self._models.items()}
+
+    async def stop(self):
+        """
+        Cancels the loads still running
+        """
+        tasks = [state.task for state in self._models.values()
+                 if state.task is not None and not state.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,62 @@
+"""
+This module contains a fixed size ring buffer for raw PCM audio
+"""
+
+
+class PCMRingBuffer:
+    """
+    Byte ring buffer preallocated once.
+    Writing past the capacity overwrites the oldest audio
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buffer = bytearray(capacity)
+        self._start = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def write(self, data: bytes):
+        """
+        Appends audio, keeping only the newest capacity bytes
+        """
+        data = memoryview(data)
+        if len(data) >= self.capacity:
+            self._buffer[:] = data[len(data) - self.capacity:]
+            self._start = 0
+            self._size = self.capacity
+            return
+
+        end = (self._start + self._size) % self.capacity
+        first = min(len(data), self.capacity - end)
+        self._buffer[end:end + first] = data[:first]
+        self._buffer[:len(data) - first] = data[first:]
+
+        overflow = self._size + len(data) - self.capacity
+        if overflow > 0:
+            self._start = (self._start + overflow) % self.capacity
+            self._size = self.capacity
+        else:
+            self._size += len(data)
+
+    def read(self, last: int | None = None) -> bytes:
+        """
+        Returns the buffered audio, oldest first.
+        With last only the newest last bytes are returned
+        """
+        start, size = self._start, self._size
+        if last is not None and last < size:
+            start = (start + size - last) % self.capacity
+            size = last
+        end = start + size
+        if end <= self.capacity:
+            return bytes(self._buffer[start:end])
+        return bytes(self._buffer[start:]) + \
+            bytes(self._buffer[:end - self.capacity])
+
+    def clear(self):
+        """Drops all the buffered audio"""
+        self._start = 0
+        self._size = 0
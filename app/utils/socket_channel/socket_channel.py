@@ -0,0 +1,248 @@
+"""
+This module contains the framing layer of the websockets.
+Frames go through a bounded queue drained by a sender task per socket,
+token deltas are coalesced into fewer frames and the client can negotiate
+msgpack binary frames instead of text JSON
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+import msgpack
+from fastapi import WebSocket
+
+JSON_PROTOCOL = "aurelius.json"
+MSGPACK_PROTOCOL = "aurelius.msgpack"
+SUBPROTOCOLS = (MSGPACK_PROTOCOL, JSON_PROTOCOL)
+
+# What to do when a client does not read as fast as the answers are generated
+COALESCE = "coalesce"
+DROP_TOKENS = "drop_tokens"
+DISCONNECT = "disconnect"
+BACKPRESSURE_POLICIES = (COALESCE, DROP_TOKENS, DISCONNECT)
+
+# Close code sent to the slow clients of the disconnect policy (try again later)
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+def negotiate_protocol(websocket: WebSocket) -> str | None:
+    """
+    Picks the protocol from the Sec-WebSocket-Protocol offered by the client.
+    Clients that offer none get text JSON, as before subprotocols existed
+    """
+    offered = websocket.scope.get("subprotocols") or []
+    for protocol in SUBPROTOCOLS:
+        if protocol in offered:
+            return protocol
+    return None
+
+
+class _Frame:
+    """
+    Frame waiting on the queue, token frames keep collecting deltas
+    until the sender takes them
+    """
+    __slots__ = ("data", "binary", "parts", "chars", "created")
+
+    def __init__(self, data=None, binary: bool = False):
+        self.data = data
+        self.binary = binary
+        self.parts: list[str] | None = None
+        self.chars = 0
+        self.created = time.monotonic()
+
+    @classmethod
+    def token(cls, delta: str):
+        frame = cls()
+        frame.parts = [delta]
+        frame.chars = len(delta)
+        return frame
+
+    def is_token(self) -> bool:
+        return self.parts is not None
+
+
+class SocketChannel:
+    """
+    Sends the frames of a websocket without making the caller wait for the
+    network. Frames are queued and a sender task writes them in order.
+    Token deltas merge into the token frame still queued, and the sender
+    holds a token frame up to flush_ms, or until flush_chars are pending,
+    so many deltas go in one frame. A slow client then gets bigger frames
+    instead of a longer queue.
+    When max_frames frames are queued the backpressure policy applies:
+    coalesce makes the caller wait for room (tokens still merge),
+    drop_tokens drops the queued token frames, the answer frame carries the
+    whole text anyway, and disconnect closes the socket.
+    With the msgpack protocol every frame is a binary msgpack value, audio
+    included, which arrives as a msgpack bin value
+    """
+
+    def __init__(self, websocket: WebSocket, connection_id: str,
+                 protocol: str | None = None, flush_ms: float | None = None,
+                 flush_chars: int | None = None, max_frames: int | None = None,
+                 policy: str | None = None):
+        self.websocket = websocket
+        self.connection_id = connection_id
+        self.protocol = protocol or JSON_PROTOCOL
+        if flush_ms is None:
+            flush_ms = float(os.getenv('AURELIUS_WS_FLUSH_MS', '16'))
+        self.flush_interval = flush_ms / 1000
+        self.flush_chars = flush_chars or int(os.getenv('AURELIUS_WS_FLUSH_CHARS', '256'))
+        self.max_frames = max_frames or int(os.getenv('AURELIUS_WS_QUEUE_FRAMES', '64'))
+        self.policy = policy or os.getenv('AURELIUS_WS_BACKPRESSURE', COALESCE)
+        if self.policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown websocket backpressure policy {self.policy}")
+        self.dropped_tokens = 0
+        self._queue: deque[_Frame] = deque()
+        self._queued = asyncio.Event()
+        self._room = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._error: Exception | None = None
+        self._sender = asyncio.create_task(self._send_frames())
+
+    async def send_json(self, data: dict):
+        """
+        Queues a frame, token frames are coalesced
+        """
+        self._raise_if_closed()
+        if data.get("type") == "token":
+            self._queue_token(data["message"])
+            return
+        await self._put(_Frame(data))
+
+    async def send_bytes(self, data):
+        """
+        Queues binary data like the audio of a sentence
+        """
+        self._raise_if_closed()
+        await self._put(_Frame(data, binary=True))
+
+    def _queue_token(self, delta: str):
+        if self._queue and self._queue[-1].is_token():
+            last = self._queue[-1]
+            last.parts.append(delta)
+            last.chars += len(delta)
+            if last.chars >= self.flush_chars:
+                self._queued.set()
+            return
+        if len(self._queue) >= self.max_frames:
+            if self.policy == DROP_TOKENS:
+                self.dropped_tokens += 1
+                return
+            if self.policy == DISCONNECT:
+                self._disconnect_slow_consumer()
+                return
+            # coalesce: one token frame over the bound, the next deltas merge on it
+        self._append(_Frame.token(delta))
+
+    async def _put(self, frame: _Frame):
+        while len(self._queue) >= self.max_frames:
+            if self.policy == DISCONNECT:
+                self._disconnect_slow_consumer()
+                return
+            if self.policy == DROP_TOKENS and self._drop_queued_tokens():
+                continue
+            self._room.clear()
+            await self._room.wait()
+            self._raise_if_closed()
+        self._append(frame)
+
+    def _append(self, frame: _Frame):
+        self._queue.append(frame)
+        self._drained.clear()
+        self._queued.set()
+
+    def _drop_queued_tokens(self) -> bool:
+        """Removes the queued token frames, tells if any was removed"""
+        kept = deque(frame for frame in self._queue if not frame.is_token())
+        dropped = len(self._queue) - len(kept)
+        self._queue = kept
+        self.dropped_tokens += dropped
+        return dropped > 0
+
+    def _disconnect_slow_consumer(self):
+        print(f"[WS] Closing slow connection {self.connection_id}")
+        self._fail(ConnectionError("The client is not reading the websocket"))
+        asyncio.create_task(self._close_socket(SLOW_CONSUMER_CLOSE_CODE))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except RuntimeError:
+            # Already closed by the client
+            pass
+
+    def _raise_if_closed(self):
+        if self._error is not None:
+            raise self._error
+
+    def _fail(self, error: Exception):
+        """Stops the channel, the callers get the error on their next send"""
+        if self._error is None:
+            self._error = error
+        self._queue.clear()
+        self._room.set()
+        self._drained.set()
+        if self._sender is not asyncio.current_task():
+            self._sender.cancel()
+
+    async def _send_frames(self):
+        while True:
+            if not self._queue:
+                self._drained.set()
+                self._queued.clear()
+                await self._queued.wait()
+                continue
+
+            frame = self._queue[0]
+            if frame.is_token() and len(self._queue) == 1 \
+                    and frame.chars < self.flush_chars:
+                # Hold the deltas a moment so the next ones share the frame
+                wait = frame.created + self.flush_interval - time.monotonic()
+                if wait > 0:
+                    self._queued.clear()
+                    try:
+                        await asyncio.wait_for(self._queued.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+            self._queue.popleft()
+            self._room.set()
+            try:
+                await self._send(frame)
+            except Exception as e:
+                # WebSocketDisconnect included, nobody awaits this task so
+                # every error has to stop the channel
+                self._fail(ConnectionError(f"Websocket send failed: {e!r}"))
+                return
+
+    async def _send(self, frame: _Frame):
+        if frame.is_token():
+            data = {"message": "".join(frame.parts), "type": "token"}
+        else:
+            data = frame.data
+
+        if self.protocol == MSGPACK_PROTOCOL:
+            await self.websocket.send_bytes(msgpack.packb(data))
+        elif frame.binary:
+            await self.websocket.send_bytes(data)
+        else:
+            await self.websocket.send_text(
+                json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+    async def drain(self):
+        """
+        Waits until every queued frame was sent, like before closing the socket
+        """
+        await self._drained.wait()
+        self._raise_if_closed()
+
+    def close(self):
+        """
+        Stops the sender task, the frames still queued are dropped
+        """
+        self._fail(ConnectionError("The websocket is closed"))
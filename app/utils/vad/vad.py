@@ -0,0 +1,135 @@
+"""
+This module contains a frame level voice activity detector for raw PCM audio
+"""
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from app.utils.ring_buffer.ring_buffer import PCMRingBuffer
+
+# 16 bit full scale, squared because the levels come from the mean power
+FULL_SCALE_POWER = 32768.0 ** 2
+
+
+class VoiceActivityDetector:
+    """
+    Splits 16 bit mono PCM into fixed size frames, whatever the size of the
+    chunks the client sends, and decides frame by frame if there is speech.
+
+    - The energy of every frame of a chunk is computed at once over a strided
+      view of the chunk, frames are never copied
+    - Speech starts after start_frames consecutive frames start_margin_db over
+      the noise floor and continues while frames stay stop_margin_db over it
+      (hysteresis), plus hangover_ms so pauses between words do not cut it
+    - The noise floor follows the level of the frames without speech
+    - The last pre_roll_ms before the speech start are kept so word onsets
+      are not clipped
+
+    process returns ("start", pre_roll_audio), ("speech", audio) and
+    ("end", None) events in stream order
+    """
+
+    def __init__(self, sample_rate: int = 16000, frame_ms: int = 20,
+                 start_margin_db: float = 12.0, stop_margin_db: float = 6.0,
+                 min_speech_db: float = -50.0, start_frames: int = 3,
+                 hangover_ms: int = 500, pre_roll_ms: int = 300,
+                 initial_noise_db: float = -60.0, noise_adapt: float = 0.05):
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.frame_bytes = self.frame_samples * 2
+        self.start_margin_db = start_margin_db
+        self.stop_margin_db = stop_margin_db
+        self.min_speech_db = min_speech_db
+        self.start_frames = start_frames
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.noise_adapt = noise_adapt
+        self._pre_roll = PCMRingBuffer(
+            max(self.frame_bytes, pre_roll_ms * sample_rate * 2 // 1000))
+        self.noise_db = initial_noise_db
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets the current speech state, the noise floor is kept
+        """
+        self.speaking = False
+        self._onset = 0
+        self._hangover = 0
+        self._carry = b""
+        self._pre_roll.clear()
+
+    def in_hangover(self) -> bool:
+        """
+        Tells if the speech is in a pause that may end it
+        """
+        return self.speaking and self._hangover < self.hangover_frames
+
+    def frame_levels(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Returns the level in dBFS of every complete frame of int16 samples
+        """
+        count = len(samples) // self.frame_samples
+        frames = as_strided(samples, shape=(count, self.frame_samples),
+                            strides=(self.frame_samples * samples.itemsize,
+                                     samples.itemsize),
+                            writeable=False)
+        power = np.einsum("ij,ij->i", frames, frames, dtype=np.float64)
+        power /= self.frame_samples * FULL_SCALE_POWER
+        return 10.0 * np.log10(np.maximum(power, 1e-12))
+
+    def _update_noise(self, level: float):
+        # Falls fast to quieter rooms and rises slowly, speech barely moves it
+        if level < self.noise_db:
+            self.noise_db += (level - self.noise_db) * 0.5
+        else:
+            self.noise_db += (level - self.noise_db) * self.noise_adapt
+
+    def process(self, chunk: bytes) -> list[tuple[str, bytes | None]]:
+        """
+        Adds a chunk of audio and returns the speech events it produced
+        """
+        data = self._carry + chunk if self._carry else chunk
+        usable = len(data) - len(data) % self.frame_bytes
+        view = memoryview(data)
+        self._carry = bytes(view[usable:])
+        if usable == 0:
+            return []
+
+        samples = np.frombuffer(data, dtype=np.int16, count=usable // 2)
+        levels = self.frame_levels(samples).tolist()
+        events = []
+        # Speech that continues from the previous chunk starts with this one
+        run_start = 0 if self.speaking else None
+
+        for index, level in enumerate(levels):
+            start = index * self.frame_bytes
+            if not self.speaking:
+                if level > self.noise_db + self.start_margin_db and level > self.min_speech_db:
+                    self._onset += 1
+                else:
+                    self._onset = 0
+                    self._update_noise(level)
+
+                if self._onset >= self.start_frames:
+                    self.speaking = True
+                    self._onset = 0
+                    self._hangover = self.hangover_frames
+                    events.append(("start", self._pre_roll.read()))
+                    self._pre_roll.clear()
+                    run_start = start
+                else:
+                    self._pre_roll.write(view[start:start + self.frame_bytes])
+                continue
+
+            if level > self.noise_db + self.stop_margin_db:
+                self._hangover = self.hangover_frames
+            else:
+                self._hangover -= 1
+
+            if self._hangover <= 0:
+                end = start + self.frame_bytes
+                events.append(("speech", bytes(view[run_start:end])))
+                events.append(("end", None))
+                self.speaking = False
+                run_start = None
+
+        if run_start is not None:
+            events.append(("speech", bytes(view[run_start:usable])))
+        return events
@@ -1,4 +1,15 @@
+"""
+This module contains the audio I/O helpers: WAV encoding, zero copy PCM
+views and the resampling to the format whisper expects
+"""
 import struct
+import numpy as np
+import soxr
+
+WAV_HEADER_SIZE = 44
+# Data size used by streamed WAVs whose length is not known yet
+STREAMING_DATA_SIZE = 0xFFFFFFFF - 36
+WHISPER_SAMPLE_RATE = 16000
 
 
 class WavConverter:
@@ -7,7 +18,7 @@ class WavConverter:
 
     @staticmethod
     def create_wav_header(sample_rate: int, channels: int, sample_width: int, data_size: int) -> bytes:
-        """Generates a minimal WAV header."""
+        """Generates a minimal WAV header. sample_width is in bytes"""
 
         # Format chunk
         sub_chunk_1_size = 16
@@ -18,34 +29,20 @@ class WavConverter:
         # Main header size (44 bytes for a standard WAV file)
         chunk_size = 36 + data_size
 
-        header = bytearray()
-
-        # RIFF chunk
-        header.extend(b'RIFF')
-        header.extend(struct.pack('<I', chunk_size))
-        header.extend(b'WAVE')
-
-        # fmt chunk
-        header.extend(b'fmt ')
-        header.extend(struct.pack('<I', sub_chunk_1_size))
-        header.extend(struct.pack('<H', audio_format))
-        header.extend(struct.pack('<H', channels))
-        header.extend(struct.pack('<I', sample_rate))
-        header.extend(struct.pack('<I', byte_rate))
-        header.extend(struct.pack('<H', block_align))
-        header.extend(struct.pack('<H', sample_width * 8))
-
-        # data chunk
-        header.extend(b'data')
-        header.extend(struct.pack('<I', data_size))
-
-        return bytes(header)
+        return struct.pack(
+            '<4sI4s4sIHHIIHH4sI',
+            b'RIFF', chunk_size, b'WAVE',
+            b'fmt ', sub_chunk_1_size, audio_format, channels, sample_rate,
+            byte_rate, block_align, sample_width * 8,
+            b'data', data_size)
 
     @staticmethod
     def pcm_to_wav(pcm_data: bytes, sample_rate: int = 16000,
                    channels: int = 1, bits_per_sample: int = 16) -> bytes:
         """
         Convert raw PCM data to WAV format.
+        The header and the PCM are joined on a single allocation, the PCM is
+        copied once
 
         :param pcm_data: Raw PCM audio data
         :param sample_rate: Sample rate in Hz
@@ -53,6 +50,148 @@ class WavConverter:
         :param bits_per_sample: Bits per sample
         :return: Complete WAV file as bytes
         """
+        header, data = WavConverter.pcm_to_wav_parts(
+            pcm_data, sample_rate, channels, bits_per_sample)
+        return b"".join((header, data))
+
+    @staticmethod
+    def pcm_to_wav_parts(pcm_data: bytes, sample_rate: int = 16000,
+                         channels: int = 1, bits_per_sample: int = 16
+                         ) -> tuple[bytes, memoryview]:
+        """
+        Returns the WAV header and a view of the PCM data without copying it,
+        for writers that can send both parts one after the other
+        """
+        data = memoryview(pcm_data).cast("B")
         header = WavConverter.create_wav_header(
-            len(pcm_data), sample_rate, channels, bits_per_sample)
-        return header + pcm_data
+            sample_rate=sample_rate, channels=channels,
+            sample_width=bits_per_sample // 8, data_size=len(data))
+        return header, data
+
+    @staticmethod
+    def float_to_wav(audio: np.ndarray, sample_rate: int) -> bytearray:
+        """
+        Encodes float audio in [-1, 1] as a 16 bit mono WAV.
+        The samples are converted straight into the output buffer
+        """
+        wav = bytearray(WAV_HEADER_SIZE + len(audio) * 2)
+        wav[:WAV_HEADER_SIZE] = WavConverter.create_wav_header(
+            sample_rate=sample_rate, channels=1, sample_width=2,
+            data_size=len(audio) * 2)
+        pcm = np.frombuffer(wav, dtype="<i2", offset=WAV_HEADER_SIZE)
+        np.multiply(np.clip(audio, -1.0, 1.0), 32767, out=pcm, casting="unsafe")
+        return wav
+
+
+class StreamingWavWriter:
+    """
+    Writes a WAV whose length is not known when it starts.
+    The header goes first and the data chunks are passed through as they arrive.
+    Seekable files get the real sizes written on close, streamed ones keep
+    the maximum size, which players read as "until the end of the stream"
+    """
+
+    def __init__(self, sink, sample_rate: int, channels: int = 1,
+                 bits_per_sample: int = 16):
+        """
+        :param sink: object with a write method, like a file or a BytesIO
+        """
+        self.sink = sink
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = bits_per_sample // 8
+        self.data_size = 0
+        self.sink.write(WavConverter.create_wav_header(
+            sample_rate=sample_rate, channels=channels,
+            sample_width=self.sample_width, data_size=STREAMING_DATA_SIZE))
+
+    def write(self, pcm_data) -> int:
+        """
+        Appends PCM data, bytes, memoryview or a numpy array, without copying it
+        """
+        data = memoryview(pcm_data).cast("B")
+        self.sink.write(data)
+        self.data_size += len(data)
+        return len(data)
+
+    def close(self):
+        """
+        Writes the final sizes when the sink supports seeking
+        """
+        seekable = getattr(self.sink, "seekable", None)
+        if seekable is None or not seekable():
+            return
+        position = self.sink.tell()
+        self.sink.seek(0)
+        self.sink.write(WavConverter.create_wav_header(
+            sample_rate=self.sample_rate, channels=self.channels,
+            sample_width=self.sample_width, data_size=self.data_size))
+        self.sink.seek(position)
+
+
+def pcm_as_int16(pcm_data) -> np.ndarray:
+    """
+    Returns 16 bit PCM as a read only numpy array sharing the same memory
+    """
+    view = memoryview(pcm_data).cast("B")
+    return np.frombuffer(view, dtype="<i2", count=len(view) // 2)
+
+
+def to_whisper_audio(pcm_data, sample_rate: int = WHISPER_SAMPLE_RATE,
+                     channels: int = 1) -> np.ndarray:
+    """
+    Converts 16 bit PCM to the float32 16 kHz mono audio whisper expects.
+    Channels are averaged and the audio is resampled in one vectorized pass
+    """
+    samples = pcm_as_int16(pcm_data)
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels]
+        audio = samples.reshape(-1, channels).mean(axis=1, dtype=np.float32)
+        audio *= 1.0 / 32768.0
+    else:
+        audio = samples.astype(np.float32)
+        audio *= 1.0 / 32768.0
+    if sample_rate != WHISPER_SAMPLE_RATE:
+        audio = soxr.resample(audio, sample_rate, WHISPER_SAMPLE_RATE)
+    return audio
+
+
+class PCMResampler:
+    """
+    Converts a live 16 bit PCM stream to 16 kHz mono 16 bit PCM chunk by chunk.
+    The resampler keeps its filter state between chunks so the
+    chunk boundaries do not click
+    """
+
+    def __init__(self, sample_rate: int, channels: int = 1):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self._stream = None
+        if sample_rate != WHISPER_SAMPLE_RATE:
+            self._stream = soxr.ResampleStream(
+                sample_rate, WHISPER_SAMPLE_RATE, 1, dtype="int16")
+        self._carry = b""
+
+    def is_passthrough(self) -> bool:
+        """Tells if the stream already is 16 kHz mono"""
+        return self._stream is None and self.channels == 1
+
+    def process(self, pcm_data: bytes) -> bytes:
+        """
+        Returns the chunk as 16 kHz mono PCM
+        """
+        if self.is_passthrough():
+            return pcm_data
+
+        frame_bytes = 2 * self.channels
+        data = self._carry + pcm_data if self._carry else pcm_data
+        usable = len(data) - len(data) % frame_bytes
+        self._carry = bytes(memoryview(data)[usable:])
+
+        samples = pcm_as_int16(memoryview(data)[:usable])
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels).mean(
+                axis=1).astype(np.int16)
+        if self._stream is not None:
+            samples = self._stream.resample_chunk(samples)
+        return samples.tobytes()